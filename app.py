@@ -9,8 +9,12 @@ from flask_jwt_extended import (
 from flask_cors import CORS
 from flask_swagger_ui import get_swaggerui_blueprint
 from flask_bcrypt import Bcrypt
+import db
+from conditional import catalog_conditional, entity_conditional
+from idempotency import idempotent
 
 app = Flask(__name__)
+db.init_app(app)
 jwt = JWTManager(app)
 CORS(app)
 bcrypt = Bcrypt(app) 
@@ -147,10 +151,22 @@ def delete_admin_id():
     """
     return delete_admin_controller()
 
+@app.get("/admin/metrics")
+@jwt_required()
+def get_metrics():
+    """
+    Retrieves the database and cache counters of the serving worker, requires admin authentication.
+
+    Returns:
+        dict: Dictionary containing the counters.
+    """
+    return get_metrics_controller()
+
 
 # PRODUCTS
 
 @app.get("/products")
+@catalog_conditional
 def get_products():
     """
     Retrieves all products.
@@ -162,6 +178,7 @@ def get_products():
 
 
 @app.get("/products/<int:id>")
+@entity_conditional
 def products_by_id(id):
     """
     Retrieves product by ID.
@@ -187,6 +204,30 @@ def upload():
     return add_product_controller()
 
 
+@app.post("/products/import")
+@jwt_required()
+def import_products_upload():
+    """
+    Imports many products from an uploaded CSV or NDJSON file, admins only.
+
+    Returns:
+        dict: Dictionary containing the import counts and per-line errors.
+    """
+    return import_products_controller()
+
+
+@app.patch("/products")
+@jwt_required()
+def update_products_price_and_stock_bulk():
+    """
+    Updates the price and/or stock of many products at once, admins only.
+
+    Returns:
+        dict: Dictionary containing the number of updated products.
+    """
+    return update_products_price_and_stock_controller()
+
+
 @app.put("/products/<int:id>")
 @jwt_required()
 def update(id):
@@ -202,6 +243,21 @@ def update(id):
     return update_product_controller(id)
 
 
+@app.patch("/products/<int:id>")
+@jwt_required()
+def patch(id):
+    """
+    Updates only the supplied fields of a product by ID.
+
+    Parameters:
+        id (int): The ID of the product to update.
+
+    Returns:
+        dict: Dictionary containing the updated product.
+    """
+    return patch_product_controller(id)
+
+
 @app.delete("/products/<int:id>")
 @jwt_required()
 def delete(id):
@@ -220,6 +276,7 @@ def delete(id):
 # IMAGES
 
 @app.get("/products/<int:product_id>/images")
+@catalog_conditional
 def product_images(product_id):
     """
     Retrieves all images of a product.
@@ -297,6 +354,7 @@ def delete_images(product_id):
 # CATEGORIES
 
 @app.get("/categories")
+@catalog_conditional
 def get_all_categories():
     """
     Retrieves all categories.
@@ -308,6 +366,7 @@ def get_all_categories():
 
 
 @app.get("/categories/<int:category_id>/products")
+@catalog_conditional
 def products_by_category(category_id):
     """
     Retrieves products by category ID.
@@ -322,6 +381,7 @@ def products_by_category(category_id):
 
 
 @app.get("/categories/<int:id>")
+@catalog_conditional
 def get_category_by_id(id):
     """
     Retrieves category by ID.
@@ -404,6 +464,18 @@ def add_user_carts():
     return add_carts_user_controller()
 
 
+@app.post("/carts/bulk")
+@jwt_required()
+def add_user_carts_bulk():
+    """
+    Adds several products to the user's carts at once.
+
+    Returns:
+        dict: Dictionary containing the result of every product.
+    """
+    return add_carts_bulk_user_controller()
+
+
 @app.delete("/carts")
 @jwt_required()
 def delete_user_carts():
@@ -445,8 +517,20 @@ def get_user_transactions():
     """
     return get_all_user_transactions_controller()
 
+@app.get("/transactions/export")
+@jwt_required()
+def export_transactions():
+    """
+    Streams every transaction with its details as NDJSON or CSV, admins only.
+
+    Returns:
+        Response: Streamed export of the transactions.
+    """
+    return export_transactions_controller()
+
 @app.post("/transactions/carts")
 @jwt_required()
+@idempotent
 def add_user_transaction_from_carts():
     """
     Adds a transaction for the user based on their cart contents.
@@ -458,6 +542,7 @@ def add_user_transaction_from_carts():
 
 @app.post("/transactions")
 @jwt_required()
+@idempotent
 def add_user_transactions():
     """
     Adds transactions for the user.
@@ -0,0 +1,168 @@
+import copy, functools, inspect, threading, time
+from collections import OrderedDict
+
+# Every cache created in this process, by name, for stats().
+_caches = {}
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory cache with least-recently-used eviction and a time to live.
+
+    The cache lives in the worker process, so with several workers each one
+    keeps its own copy: a write invalidates the cache of the worker that made
+    it, and the other workers pick the change up when their entries expire.
+    Values are deep-copied on the way in and out, so callers may freely modify
+    what they get back.
+
+    When `version` is given, every entry is tagged with the version current
+    when it started loading, and an entry tagged with another version than the
+    current one is a miss. Writes made by other workers then reach this cache
+    as soon as they change the version, without waiting for the TTL.
+
+    Args:
+        name (str): Name reported by stats().
+        maxsize (int): Maximum number of entries kept.
+        ttl (float): Seconds an entry stays valid.
+        version (callable, optional): Returns the current version of the cached data.
+    """
+    def __init__(self, name, maxsize, ttl, version=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = version
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so a load that started before it does
+        # not store its (possibly stale) result afterwards.
+        self._generation = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0, "stale": 0}
+        _caches[name] = self
+
+    def _current_version(self):
+        return self.version() if self.version else None
+
+    def get(self, key, default=None):
+        """
+        Return the cached value for key, or default if it is missing, expired or of another version.
+        """
+        return self._get(key, default, self._current_version())
+
+    def _get(self, key, default, version):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] < time.monotonic():
+                del self._data[key]
+                self._stats["expirations"] += 1
+                entry = _MISSING
+            if entry is not _MISSING and entry[2] != version:
+                del self._data[key]
+                self._stats["stale"] += 1
+                entry = _MISSING
+            if entry is _MISSING:
+                self._stats["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            value = entry[1]
+        return copy.deepcopy(value)
+
+    def set(self, key, value, generation=None, version=_MISSING):
+        """
+        Store value under key, evicting the least recently used entries when full.
+
+        If generation is given and the cache was invalidated since it was read,
+        the value is dropped instead. The entry is tagged with `version`, by
+        default the current one.
+        """
+        if version is _MISSING:
+            version = self._current_version()
+        value = copy.deepcopy(value)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value, version)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def get_or_load(self, key, load):
+        """
+        Return the cached value for key, calling load() and caching its result on a miss.
+        """
+        # The version is read before loading, so the entry never claims a
+        # newer version than the data it holds
+        version = self._current_version()
+        value = self._get(key, _MISSING, version)
+        if value is not _MISSING:
+            return value
+        generation = self._generation
+        value = load()
+        self.set(key, value, generation, version)
+        return value
+
+    def invalidate(self, key):
+        """
+        Remove a single entry.
+        """
+        with self._lock:
+            self._generation += 1
+            self._stats["invalidations"] += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+        with self._lock:
+            self._generation += 1
+            self._stats["invalidations"] += 1
+            self._data.clear()
+
+    def stats(self):
+        """
+        Return the counters of this cache together with its current size.
+        """
+        with self._lock:
+            return dict(self._stats, size=len(self._data), maxsize=self.maxsize, ttl=self.ttl)
+
+
+def stats():
+    """
+    Return the statistics of every cache in this process.
+
+    Returns:
+        dict: A dictionary mapping cache names to their LRUCache.stats().
+    """
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+def cached(cache, key=None):
+    """
+    Decorate a function so its results are served from cache.
+
+    Parameters:
+        cache (LRUCache): The cache holding the results.
+        key (callable, optional): Builds the cache key from the call's arguments,
+            passed by name with defaults applied. Defaults to the tuple of all
+            argument values.
+
+    The undecorated function stays reachable as `.uncached`, for callers that
+    must read the current database state (e.g. inside a write transaction).
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            cache_key = key(**bound.arguments) if key else tuple(bound.arguments.values())
+            return cache.get_or_load(cache_key, lambda: func(*args, **kwargs))
+
+        wrapper.uncached = func
+        return wrapper
+
+    return decorator
@@ -0,0 +1,73 @@
+import functools
+from flask import request, make_response
+from models.catalog import current_catalog_version
+
+
+def catalog_conditional(view):
+    """
+    Decorate a catalog GET view with ETag / Last-Modified validation.
+
+    The validators come from this worker's view of the catalog version (see
+    models.catalog.current_catalog_version), which the view's cached reads are
+    tagged with as well. When the client's If-None-Match or
+    If-Modified-Since still matches, a 304 is answered straight away, without
+    running the view's queries or serializing its result.
+
+    Parameters:
+        view (callable): The Flask view function to wrap.
+
+    Returns:
+        callable: The wrapped view.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version, updated_at = current_catalog_version()
+        etag = f"catalog-{version}"
+        # HTTP dates have a one second resolution
+        last_modified = updated_at.replace(microsecond=0)
+
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        else:
+            not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+        if not_modified:
+            response = make_response("", 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # Clients may keep the response but must revalidate it before reuse
+        response.cache_control.no_cache = True
+        return response
+
+    return wrapper
+
+
+def entity_conditional(view):
+    """
+    Decorate a GET view whose response carries its own ETag with If-None-Match
+    validation.
+
+    Unlike catalog_conditional, the view always runs: the entity tag depends
+    on what it reads (e.g. a product's version, see
+    controllers.product_controller.product_etag). A matching If-None-Match
+    turns the response into a 304.
+
+    Parameters:
+        view (callable): The Flask view function to wrap.
+
+    Returns:
+        callable: The wrapped view.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200:
+            return response
+        # Clients may keep the response but must revalidate it before reuse
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    return wrapper
@@ -2,4 +2,5 @@ from controllers.auth_controller import *
 from controllers.product_controller import *
 from controllers.category_controller import *
 from controllers.carts_controller import *
-from controllers.transactions_controller import *
\ No newline at end of file
+from controllers.transactions_controller import *
+from controllers.metrics_controller import *
\ No newline at end of file
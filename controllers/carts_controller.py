@@ -2,12 +2,19 @@ from models import *
 from errors import *
 from flask import request
 from flask_jwt_extended import get_jwt_identity
+from werkzeug.datastructures import MultiDict
 from form_validator import get_cart_form,add_cart_form,validate_date_format
 
+# Most items accepted by one bulk add-to-cart request
+MAX_BULK_CART_ITEMS = 100
+
 def get_carts_user_controller():
     """
     Controller function to retrieve carts belonging to the current user.
 
+    With `expand=products` the caller's whole cart is returned with product
+    name, price, stock, first image and subtotal of every line, plus the grand total.
+
     Returns:
         dict: A dictionary containing cart data if found.
         dict: Error message with status code 404 if carts are not found.
@@ -19,6 +26,18 @@ def get_carts_user_controller():
         page = request.args.get('page', 1)
         max_date = request.args.get('max_date')
         min_date = request.args.get('min_date')
+        cursor = request.args.get('cursor')
+        expand = request.args.get('expand')
+
+        # Expanded mode: the caller's cart with its products and totals
+        if expand is not None:
+            if expand != "products":
+                raise ValueError({"expand": ["Supported value: products"]})
+            user_carts = get_cart_details_by_user_id(get_jwt_identity()["id"])
+            if user_carts is None:
+                raise DatabaseError("Your shopping cart is empty")
+            return user_carts
+
         # Check if either max_date or min_date is provided in the request
         if max_date or min_date:
 
@@ -48,11 +67,11 @@ def get_carts_user_controller():
         # Checking if the user is an admin
         if get_jwt_identity()['role'] == 'admin':
             # If admin, retrieve all carts
-            return get_all_carts(page, limit, max_date, min_date)
+            return get_all_carts(page, limit, max_date, min_date, cursor)
         
         # If not admin, retrieve carts for the current user
         user_id = get_jwt_identity()["id"]
-        user_carts = get_carts_by_user_id(user_id, page, limit, max_date, min_date)
+        user_carts = get_carts_by_user_id(user_id, page, limit, max_date, min_date, cursor)
         
         # If user carts are empty, raise an error
         if not user_carts:
@@ -86,28 +105,20 @@ def add_carts_user_controller():
             errors = {field.name: field.errors for field in form if field.errors}
             raise ValueError(errors)
         
-        # Retrieving product information
-        product = get_product_by_id(product_id)
+        # Adding the product or updating its quantity, if enough is in stock
+        cart = upsert_cart(user_id, product_id, int(quantity))
         
         # Checking if the product exists
-        if product is None:
+        if cart["stock"] is None:
             raise DatabaseError(f"Product with ID {product_id} not found")
         
         # Checking if the requested quantity exceeds available stock
-        if product['quantity'] < int(quantity):
-            raise DatabaseError(f"Stock of product with ID {product_id} is only {product['quantity']} items")
+        if cart["cart_id"] is None:
+            raise DatabaseError(f"Stock of product with ID {product_id} is only {cart['stock']} items")
         
-        # Checking if the user already has the product in their cart
-        if get_carts_by_user_id_and_product_id(user_id, product_id) is None:
-            # If not, add the product to the cart
-            add_carts(user_id, product_id, quantity)
-            result = {"message": "Successfully added to cart"}, 200
-            return result
-        else:
-            update_cart(product_id, user_id, quantity)
-            # If yes, update the quantity in the cart
-            result = {"message": "Quantity updated successfully"}, 200
-            return result
+        if cart["inserted"]:
+            return {"message": "Successfully added to cart"}, 200
+        return {"message": "Quantity updated successfully"}, 200
     except ValueError as ve:
         return {"errors": ve.args[0]}, 422
     except DatabaseError as e:
@@ -116,6 +127,82 @@ def add_carts_user_controller():
         raise e
 
 
+def add_carts_bulk_user_controller():
+    """
+    Controller function to add several products to the user's cart at once.
+
+    Items are read from a JSON body, either a list or {"items": [...]} of
+    {"product_id", "quantity"} objects, or from repeated product_id and
+    quantity form fields. A product listed twice gets the sum of its quantities.
+
+    Returns:
+        dict: A dictionary containing a message and the result of every product, with
+        "status" one of "added", "updated", "not_found" or "insufficient_stock".
+        dict: Error message with status code 422 if the items are invalid.
+    """
+    try:
+        # Getting the user ID from the JWT token
+        user_id = get_jwt_identity()["id"]
+
+        # Retrieving the items from the JSON body or the request form
+        if request.is_json:
+            body = request.get_json(silent=True)
+            items = body.get("items") if isinstance(body, dict) else body
+            if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+                raise ValueError({"items": ["Must be a list of objects with product_id and quantity"]})
+        else:
+            product_ids = request.form.getlist("product_id")
+            quantities = request.form.getlist("quantity")
+            if len(product_ids) != len(quantities):
+                raise ValueError({"items": ["Each product_id needs a quantity"]})
+            items = [
+                {"product_id": product_id, "quantity": quantity}
+                for product_id, quantity in zip(product_ids, quantities)
+            ]
+        if not items:
+            raise ValueError({"items": ["Please add at least one item"]})
+        if len(items) > MAX_BULK_CART_ITEMS:
+            raise ValueError({"items": [f"At most {MAX_BULK_CART_ITEMS} items per request"]})
+
+        # Validating every item like a single add to cart
+        quantities = {}
+        errors = {}
+        for i, item in enumerate(items):
+            form = add_cart_form(MultiDict({
+                "product_id": str(item.get("product_id", "")),
+                "quantity": str(item.get("quantity", "")),
+            }))
+            if not form.validate():
+                errors[i] = {field.name: field.errors for field in form if field.errors}
+                continue
+            product_id = form.product_id.data
+            quantities[product_id] = quantities.get(product_id, 0) + form.quantity.data
+        if errors:
+            raise ValueError({"items": errors})
+
+        # Checking the stock and writing every cart row in one statement
+        carts = upsert_carts(user_id, quantities)
+        results = []
+        for product_id, quantity in quantities.items():
+            cart = carts[product_id]
+            if cart["stock"] is None:
+                status = "not_found"
+            elif cart["cart_id"] is None:
+                status = "insufficient_stock"
+            elif cart["inserted"]:
+                status = "added"
+            else:
+                status = "updated"
+            results.append({"product_id": product_id, "quantity": quantity, "stock": cart["stock"], "status": status})
+
+        written = sum(1 for result in results if result["status"] in ("added", "updated"))
+        return {"message": f"{written} of {len(results)} products saved to cart", "data": results}, 200
+    except ValueError as ve:
+        return {"errors": ve.args[0]}, 422
+    except Exception as e:
+        raise e
+
+
 def delete_cart_by_user_id_controller():
     """
     Controller function to delete all carts belonging to the current user.
@@ -8,10 +8,17 @@ def get_categories_controller():
     """
     Controller function to retrieve all categories.
 
+    Query Parameters:
+    - include: 'stats' adds the product count, in-stock count and min/max price of every category.
+
     Returns:
     - list: A list containing dictionaries with category information including category ID and name.
+    - dict: Error message with status code 422 if include is invalid.
     """
-    return get_categories()
+    include = request.args.get("include")
+    if include and include != "stats":
+        return {"errors": {"include": ["Unknown value '" + include + "', available: stats"]}}, 422
+    return get_categories(with_stats=include == "stats")
 
 def get_category_controller(id: int):
     """
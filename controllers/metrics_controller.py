@@ -0,0 +1,31 @@
+from flask_jwt_extended import get_jwt_identity
+from errors import Unauthorized
+import db, cache
+
+
+def get_metrics_controller():
+    """
+    Controller function to retrieve the database and cache counters of the worker serving the request.
+
+    Every worker process keeps its own counters, so successive requests may
+    report different workers.
+
+    Returns:
+    - dict: A dictionary with the following keys:
+        - "db" (dict): The counters from db.stats().
+        - "cache" (dict): The statistics of every cache from cache.stats().
+    - tuple: An error message with a 422 status code if the user is not an admin.
+    """
+    try:
+        # Checking user role
+        if get_jwt_identity()['role'] != 'admin':
+            raise Unauthorized('Unauthorized')
+
+        return {"db": db.stats(), "cache": cache.stats()}
+
+    except Unauthorized as e:
+        # Returning unauthorized message
+        return {"error": str(e)}, 422
+    except Exception as e:
+        # Raising other exceptions
+        raise e
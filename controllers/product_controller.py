@@ -2,8 +2,52 @@ from flask import request
 from models import *
 from errors import *
 from form_validator import *
-import time, os
+import time, os, io, csv, json
 from flask_jwt_extended import get_jwt_identity
+from werkzeug.datastructures import MultiDict
+
+
+def parse_include():
+    """
+    Read the `include` query parameter, a comma separated list of related data to embed.
+
+    Returns:
+    - list: Names from PRODUCT_INCLUDES, empty if the parameter is missing.
+
+    Raises:
+    - ValueError: If a name is not in PRODUCT_INCLUDES.
+    """
+    include = request.args.get("include") or ""
+    names = [name.strip() for name in include.split(",") if name.strip()]
+    for name in names:
+        if name not in PRODUCT_INCLUDES:
+            raise ValueError({"include": [f"Unknown value '{name}', available: " + ", ".join(PRODUCT_INCLUDES)]})
+    return names
+
+
+def product_etag(product: dict, include=()):
+    """
+    Build the entity tag of a product as returned by GET /products/<id>.
+
+    The tag is the product "version", quoted, which is also what PUT and PATCH
+    expect in If-Match. Embedded images or category can change without the
+    product changing, so with `include` the catalog version is appended after
+    a dot, e.g. "3.41"; if_match_version only looks at the part before it.
+
+    Parameters:
+    - product (dict): The product, with its "version".
+    - include (list): The related data embedded in the response.
+
+    Returns:
+    - str: The quoted entity tag.
+    """
+    if include:
+        return f'"{product["version"]}.{current_catalog_version_number()}"'
+    return f'"{product["version"]}"'
+
+
+# Most IDs accepted by GET /products?ids=
+MAX_PRODUCT_IDS = 100
 
 
 def get_all_products_controller():
@@ -15,12 +59,20 @@ def get_all_products_controller():
     Query Parameters:
     - limit: Number of products per page (default is 5).
     - page: Page number for pagination (default is 1).
-    - category: Filter by category name.
+    - cursor: Keyset pagination cursor; pass an empty value for the first page and then the
+      returned `next_cursor`. When present, `page` is ignored.
+    - category: Filter by category name (any case) or slug.
     - keyword: Search keyword.
+    - search_mode: 'contains' (default) for a substring match on the name, 'fts' for a
+      full-text prefix search over name and description.
+    - search_lang: Dictionary used by 'fts' search, 'simple' (default) or 'indonesian'.
     - max_price: Maximum price filter.
     - min_price: Minimum price filter.
-    - order_by: Field to order by (e.g., 'price', 'name').
+    - order_by: Field to order by (e.g., 'price', 'name', or 'relevance' with 'fts' search).
     - sort: Sorting order ('asc' for ascending, 'desc' for descending).
+    - include: Comma separated related data to embed in every product ('images', 'category').
+    - ids: Comma separated product IDs. When present the products with these IDs are returned,
+      in that order, with the IDs that do not exist under `missing`; other filters are ignored.
 
     Returns:
     - dict: A dictionary containing product data based on the specified filters.
@@ -35,33 +87,63 @@ def get_all_products_controller():
         page = int(request.args.get("page", 1))
         category = request.args.get("category")
         keyword = request.args.get("keyword")
+        search_mode = request.args.get("search_mode")
+        search_lang = request.args.get("search_lang")
         max_price = request.args.get("max_price")
         min_price = request.args.get("min_price")
         order_by = request.args.get("order_by")
         sort = request.args.get("sort")
-
-        # Check if the specified category exists in the database
+        cursor = request.args.get("cursor")
+        include = parse_include()
+
+        # Batch lookup by IDs, in one query
+        ids = request.args.get("ids")
+        if ids is not None:
+            ids = [id.strip() for id in ids.split(",") if id.strip()]
+            if not ids or not all(id.isdigit() for id in ids):
+                raise ValueError({"ids": ["Must be a comma separated list of product IDs"]})
+            if len(ids) > MAX_PRODUCT_IDS:
+                raise ValueError({"ids": [f"At most {MAX_PRODUCT_IDS} IDs per request"]})
+            return get_products_by_ids(ids, include=include)
+
+        # Resolve the category name to its ID through the category registry
+        category_data = None
         if category:
-            if not get_category_name(category):
+            category_data = resolve_category(category)
+            if not category_data:
                 raise DatabaseError(f"The category '{category}' does not exist.")
 
         # Call the model function to fetch products based on the filters
         data = get_all_products(
             page=page,
             limit=limit,
-            category=category,
+            category_id=category_data["category_id"] if category_data else None,
             keyword=keyword,
             max_price=max_price,
             min_price=min_price,
             order_by=order_by,
             sort=sort,
+            cursor=cursor,
+            search_mode=search_mode,
+            search_lang=search_lang,
+            include=include,
         )
 
+        # Label the products with the category they were filtered by, unless
+        # the whole category is embedded already
+        if category_data and "category" not in include:
+            products = data if isinstance(data, list) else data.get("data", [])
+            for product in products:
+                product["category"] = category_data["name"]
+
         # Return the fetched data
         if data:
             return data
         else:
             return {"data": []}
+    except ValueError as e:
+        # Handle an invalid pagination cursor, include or ids
+        return {"errors": e.args[0]}, 422
     except DatabaseError as e:
         # Handle DatabaseError with appropriate error message
         return {"error": str(e), "data": []}, 404
@@ -74,37 +156,58 @@ def get_products_by_category_controller(category_id: int):
     """
     Get products belonging to a specific category.
 
-    This function retrieves products that belong to the specified category ID.
+    This function retrieves one page of the products that belong to the specified category ID.
 
     Parameters:
     - category_id (int): The ID of the category.
 
+    Query Parameters:
+    - limit, page, cursor, min_price, max_price, order_by, sort, include: As for get_all_products_controller.
+
     Returns:
-    - dict: A dictionary containing category information along with its associated products.
+    - dict: A dictionary containing category information along with its associated products,
+      and `next_cursor` in cursor mode.
 
     Raises:
     - DatabaseError: If the specified category ID is not found in the database.
     - Exception: For other unexpected errors.
     """
     try:
-        # Check if the specified category ID exists in the database
-        if get_category(category_id) is None:
+        # Check if the specified category ID exists in the category registry
+        category = get_category(category_id)
+        if category is None:
             raise DatabaseError(f"The category with ID {category_id} was not found.")
 
-        # Retrieve products belonging to the specified category
-        products = get_products_by_category(category_id)
-
-        # Get category information
-        category = get_category(category_id)
+        # Retrieve one page of the products belonging to the specified category
+        cursor = request.args.get("cursor")
+        products = get_products_by_category(
+            category_id,
+            page=int(request.args.get("page", 1)),
+            limit=int(request.args.get("limit", 5)),
+            min_price=request.args.get("min_price"),
+            max_price=request.args.get("max_price"),
+            order_by=request.args.get("order_by"),
+            sort=request.args.get("sort"),
+            cursor=cursor,
+            include=parse_include(),
+        )
+        if isinstance(products, dict) and "message" in products:
+            # Invalid order_by, sort or search option
+            raise ValueError(products["message"])
 
         # Add products to the category dictionary
-        if products:
-            category["products"] = products
+        if isinstance(products, dict):
+            category["products"] = products["data"]
+            if cursor is not None:
+                category["next_cursor"] = products["next_cursor"]
         else:
-            category["products"] = []
+            category["products"] = products
 
         # Return the category with its associated products
         return category
+    except ValueError as e:
+        # Handle invalid pagination, sorting or include parameters
+        return {"errors": e.args[0]}, 422
     except DatabaseError as e:
         # Handle DatabaseError with appropriate error message
         return {"error": str(e)}, 404
@@ -120,8 +223,11 @@ def get_product_by_id_controller(id: int):
     Parameters:
     - id (int): The ID of the product to be retrieved.
 
+    Query Parameters:
+    - include: Comma separated related data to embed ('images', 'category').
+
     Returns:
-    - dict or tuple: A dictionary containing the product information or an error message with status code.
+    - tuple: The product information with its ETag (see product_etag), or an error message with status code.
       If the product ID is not provided or is empty, the dictionary contains a "message" key with an error message and a 404 status code.
       If the product ID is not found, the dictionary contains a "message" key with an error message and a 404 status code.
       If the product is found, the dictionary contains the product information.
@@ -129,11 +235,14 @@ def get_product_by_id_controller(id: int):
     try:
         if not id or id == "":
             raise ValueError("ID produk harus diisi.")
-        product = get_product_by_id(id)
+        include = parse_include()
+        product = get_product_by_id(id, include=include)
         if product is None:
             raise DatabaseError(f"produk dengan ID {id} tidak ditemukan")
-        return product
+        return product, 200, {"ETag": product_etag(product, include)}
     except ValueError as e:
+        if isinstance(e.args[0], dict):
+            return {"errors": e.args[0]}, 422
         return {"error": str(e)}, 422
     except DatabaseError as e:
         return {"error": str(e), "data": []}, 404
@@ -236,12 +345,253 @@ def add_product_controller():
         raise e
 
 
+def read_import_records(file, file_format: str):
+    """
+    Read the records of an uploaded product import file one at a time.
+
+    Parameters:
+    - file (FileStorage): The uploaded file.
+    - file_format (str): 'csv' (with a header row) or 'ndjson' (one JSON object per line).
+
+    Yields:
+    - tuple: (line, record) where line is the line number in the file and record is a
+      dictionary, or None if the line is not a JSON object.
+    """
+    text = io.TextIOWrapper(file.stream, encoding="utf-8-sig")
+    if file_format == "csv":
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line, raw in enumerate(text, 1):
+        if not raw.strip():
+            continue
+        try:
+            record = json.loads(raw)
+        except json.JSONDecodeError:
+            record = None
+        yield line, record if isinstance(record, dict) else None
+
+
+def validate_import_records(records, errors: list):
+    """
+    Validate product import records like add_product_form does for a single product.
+
+    Categories are resolved through the category registry, by `category_id` or by
+    `category` (name or slug). Invalid records are appended to `errors` and skipped.
+
+    Parameters:
+    - records (iterable): (line, record) tuples from read_import_records.
+    - errors (list): Receives {"line", "errors"} for every invalid record.
+
+    Yields:
+    - dict: The valid rows, in the format expected by import_products.
+    """
+    seen_ids = set()
+    for line, record in records:
+        if record is None:
+            errors.append({"line": line, "errors": {"line": ["Must be a JSON object."]}})
+            continue
+        record = {key: str(value).strip() for key, value in record.items() if key and value is not None}
+        if not record.get("category_id") and record.get("category"):
+            category = resolve_category(record["category"])
+            if category is None:
+                errors.append({"line": line, "errors": {"category": [f"The category '{record['category']}' does not exist."]}})
+                continue
+            record["category_id"] = str(category["category_id"])
+        form = add_product_form(MultiDict(record))
+        if not form.validate():
+            errors.append({"line": line, "errors": {field.name: field.errors for field in form if field.errors}})
+            continue
+        if not get_category(form.category_id.data):
+            errors.append({"line": line, "errors": {"category_id": [f"The category with ID {form.category_id.data} was not found."]}})
+            continue
+        product_id = record.get("id") or None
+        if product_id is not None:
+            if not product_id.isdigit():
+                errors.append({"line": line, "errors": {"id": ["id must be number"]}})
+                continue
+            product_id = int(product_id)
+            if product_id in seen_ids:
+                errors.append({"line": line, "errors": {"id": [f"Product with ID {product_id} appears more than once."]}})
+                continue
+            seen_ids.add(product_id)
+        yield {
+            "line": line,
+            "id": product_id,
+            "name": form.name.data,
+            "description": form.description.data,
+            "price": form.price.data,
+            "quantity": form.quantity.data,
+            "category_id": form.category_id.data,
+        }
+
+
+def import_products_controller():
+    """
+    Import many products from an uploaded CSV or NDJSON file.
+
+    Every record has name, description, price, quantity and either category_id or
+    category (name or slug). Records with an id update that product, the others
+    create new products. Valid records are loaded in one transaction through a
+    COPY into a staging table; invalid ones are reported by line.
+
+    Returns:
+    - dict: The number of products inserted and updated, and the errors of every rejected line.
+
+    Raises:
+    - Exception: For unexpected errors.
+    """
+    try:
+        # Check if the current user has admin role
+        if get_jwt_identity()["role"] != "admin":
+            return {"message": "Unauthorized"}, 403
+
+        # Check if file is included in the request
+        if "file" not in request.files:
+            raise FileError("Please include the CSV or NDJSON file.")
+        file = request.files["file"]
+        file_format = request.form.get("format")
+        if not file_format:
+            file_format = "ndjson" if file.filename.lower().endswith((".ndjson", ".jsonl")) else "csv"
+        if file_format not in ("csv", "ndjson"):
+            raise ValueError({"format": ["Supported values: csv, ndjson"]})
+
+        # Validate while streaming the valid rows into the database
+        errors = []
+        try:
+            result = import_products(validate_import_records(read_import_records(file, file_format), errors))
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise ValueError({"file": [f"Could not read the file: {e}"]})
+        for line in result["missing"]:
+            errors.append({"line": line, "errors": {"id": ["Product not found."]}})
+        errors.sort(key=lambda error: error["line"])
+
+        return {
+            "message": "Product import finished",
+            "inserted": result["inserted"],
+            "updated": result["updated"],
+            "errors": errors,
+        }, 200
+
+    except ValueError as ve:
+        # Handle ValueError with appropriate error message
+        return {"errors": ve.args[0]}, 422
+
+    except FileError as e:
+        # Handle FileError with appropriate error message
+        return {"error": str(e)}, 404
+
+    except Exception as e:
+        raise e
+
+
+# Most changes accepted by one bulk price and stock update
+MAX_BULK_PRODUCT_UPDATES = 10000
+
+
+def update_products_price_and_stock_controller():
+    """
+    Update the price and/or stock of many products at once.
+
+    The JSON body is a list, or {"items": [...]}, of {"id", "price", "quantity"}
+    objects where price and quantity are optional. All changes are applied by one
+    UPDATE and the product caches are invalidated once.
+
+    Returns:
+    - dict: The number of products updated and the IDs that match no product.
+    - dict: Error message with status code 422 if a change is invalid.
+    """
+    try:
+        # Check if the current user has admin role
+        if get_jwt_identity()["role"] != "admin":
+            return {"message": "Unauthorized"}, 403
+
+        body = request.get_json(silent=True)
+        items = body.get("items") if isinstance(body, dict) else body
+        if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+            raise ValueError({"items": ["Must be a non-empty list of objects with id, price and/or quantity"]})
+        if len(items) > MAX_BULK_PRODUCT_UPDATES:
+            raise ValueError({"items": [f"At most {MAX_BULK_PRODUCT_UPDATES} changes per request"]})
+
+        # Validate every change, a product may appear only once
+        changes = {}
+        errors = {}
+        for i, item in enumerate(items):
+            form = update_product_stock_form(MultiDict(
+                {key: str(value) for key, value in item.items() if key in ("id", "price", "quantity") and value is not None}
+            ))
+            if not form.validate():
+                errors[i] = {field.name: field.errors for field in form if field.errors}
+            elif form.price.data is None and form.quantity.data is None:
+                errors[i] = {"items": ["Give a price, a quantity or both"]}
+            elif form.id.data in changes:
+                errors[i] = {"id": [f"Product with ID {form.id.data} appears more than once"]}
+            else:
+                changes[form.id.data] = {"id": form.id.data, "price": form.price.data, "quantity": form.quantity.data}
+        if errors:
+            raise ValueError({"items": errors})
+
+        updated = update_products_price_and_stock(list(changes.values()))
+        missing = sorted(set(changes) - set(updated))
+        return {"message": f"{len(updated)} products updated", "updated": len(updated), "missing": missing}, 200
+    except ValueError as ve:
+        return {"errors": ve.args[0]}, 422
+    except Exception as e:
+        raise e
+
+
+def if_match_version():
+    """
+    Read the product version a client expects from the If-Match header.
+
+    The entity tag of a product for PUT and PATCH is its "version", quoted,
+    e.g. If-Match: "3", as sent in the ETag of GET /products/<id>. The ETag of
+    a GET with `include` ("3.41") is accepted as well. The new version is sent
+    back in the ETag header.
+
+    Returns:
+    - int or None: The expected version, or None without If-Match or with If-Match: *.
+
+    Raises:
+    - ValueError: If the header is not a single strong entity tag holding a version.
+    """
+    if_match = request.headers.get("If-Match")
+    if if_match is None or if_match.strip() == "*":
+        return None
+    version, _, catalog_version = if_match.strip().strip('"').partition(".")
+    if not version.isdigit() or not (catalog_version == "" or catalog_version.isdigit()):
+        raise ValueError({"If-Match": ['Must be the product version as an entity tag, e.g. "3"']})
+    return int(version)
+
+
+def version_conflict(product_id: int):
+    """
+    Build the response for a conditional product update that did not apply.
+
+    Parameters:
+    - product_id (int): The ID of the product.
+
+    Returns:
+    - tuple: 404 if the product does not exist, otherwise 412 with its current version.
+    """
+    product = get_product_by_id.uncached(product_id)
+    if product is None:
+        return {"message": f"Product with ID {product_id} not found"}, 404
+    return {
+        "error": f"Product with ID {product_id} was changed by someone else, reload it and try again.",
+        "version": product["version"],
+    }, 412, {"ETag": f'"{product["version"]}"'}
+
+
 def update_product_controller(product_id: int):
     """
     Update product information in the database.
 
     This function handles the update of product information in the database. It checks the user role,
     verifies if the product exists, validates input fields, and updates the product details.
+    With an If-Match header the update only applies if the product is still at that version,
+    otherwise 412 is returned.
 
     Args:
     - product_id (int): The ID of the product to be updated.
@@ -276,22 +626,28 @@ def update_product_controller(product_id: int):
             errors = {field.name: field.errors for field in form if field.errors}
             raise ValueError(errors)
 
-        # Check if the specified category ID exists in the database
-        if get_products_by_category(category_id) is None:
+        # Check if the specified category ID exists in the category registry
+        if get_category(category_id) is None:
             raise DatabaseError(f"Category with ID {category_id} not found.")
 
-        # Update product information in the database
-        update_product(
+        # Update product information in the database, only if it is still at
+        # the version the client saw
+        updated = update_product(
             product_id=product_id,
             name=name,
             description=description,
             price=price,
             quantity=quantity,
             category_id=category_id,
+            expected_version=if_match_version(),
         )
+        if updated is None:
+            return version_conflict(product_id)
 
         # Return success message
-        return {"message": "Product updated successfully"}, 200
+        return {"message": "Product updated successfully", "version": updated["version"]}, 200, {
+            "ETag": f'"{updated["version"]}"'
+        }
 
     except ValueError as ve:
         # Handle ValueError with appropriate error message
@@ -306,6 +662,65 @@ def update_product_controller(product_id: int):
         return e
 
 
+def patch_product_controller(product_id: int):
+    """
+    Partially update a product.
+
+    Only the fields present in the form or JSON body (name, description, price,
+    quantity, category_id) are validated, with the add_product_form rules, and
+    written, with a single query. With If-Match the update only applies if the
+    product is still at that version.
+
+    Args:
+    - product_id (int): The ID of the product to be updated.
+
+    Returns:
+    - dict: The updated product.
+    - dict: Error message with status code 404 if the product does not exist, 412 if it is no
+      longer at the If-Match version, or 422 if a field is invalid.
+    """
+    try:
+        # Check if the current user has admin role
+        if get_jwt_identity()["role"] != "admin":
+            return {"message": "Unauthorized"}, 401
+
+        # Retrieve the supplied fields from the JSON body or the request form
+        payload = request.get_json(silent=True) if request.is_json else request.form.to_dict()
+        if not isinstance(payload, dict):
+            raise ValueError({"body": ["Must be an object"]})
+        supplied = [field for field in PATCHABLE_PRODUCT_COLUMNS if payload.get(field) is not None]
+        if not supplied:
+            raise ValueError({"body": ["Give at least one of: " + ", ".join(PATCHABLE_PRODUCT_COLUMNS)]})
+
+        # Validate the supplied fields only
+        form = add_product_form(MultiDict({field: str(payload[field]) for field in supplied}))
+        form.validate()
+        errors = {field: form[field].errors for field in supplied if form[field].errors}
+        if errors:
+            raise ValueError(errors)
+        changes = {field: form[field].data for field in supplied}
+
+        # Check if the specified category ID exists in the category registry
+        if "category_id" in changes and get_category(changes["category_id"]) is None:
+            raise DatabaseError(f"Category with ID {changes['category_id']} not found.")
+
+        product = patch_product(product_id, changes, expected_version=if_match_version())
+        if product is None:
+            return version_conflict(product_id)
+        return product, 200, {"ETag": f'"{product["version"]}"'}
+
+    except ValueError as ve:
+        # Handle ValueError with appropriate error message
+        return {"errors": ve.args[0]}, 422
+
+    except DatabaseError as e:
+        # Handle DatabaseError with appropriate error message
+        return {"error": str(e), "data": []}, 422
+
+    except Exception as e:
+        raise e
+
+
 def delete_product_controller(product_id: int):
     """
     Delete a product from the database.
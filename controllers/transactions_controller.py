@@ -1,9 +1,17 @@
+import os, csv, io, json
+import psycopg2.errors
 from models import *
-from flask import request
+from flask import request, Response, stream_with_context
 from flask_jwt_extended import get_jwt_identity
 from errors import *
+from db import get_conn
+from idempotency import store_idempotent_response
 from form_validator import get_transaction_form,add_transaction_form,add_transaction_from_cart_form,validate_date_format
 
+# "function" runs checkouts through the checkout_transaction database function
+# (migration 0005) in one round trip; "python" runs the statements from here.
+CHECKOUT_MODE = os.getenv("CHECKOUT_MODE", "python")
+
 
 def get_all_user_transactions_controller():
     """
@@ -19,6 +27,7 @@ def get_all_user_transactions_controller():
         page = request.args.get("page", 1)
         max_date = request.args.get("max_date")
         min_date = request.args.get("min_date")
+        cursor = request.args.get("cursor")
          # Check if either max_date or min_date is provided in the request
         if max_date or min_date:
 
@@ -47,13 +56,13 @@ def get_all_user_transactions_controller():
         # Checking if the user is an admin
         if get_jwt_identity()["role"] == "admin":
             # If admin, return all transactions
-            return get_all_transactions(limit, page, max_date, min_date)
+            return get_all_transactions(limit, page, max_date, min_date, cursor)
         
         # If not admin, get user ID from JWT
         user_id = get_jwt_identity()["id"]
         
         # Getting transactions for the specific user
-        user_transactions = get_transactions_by_user_id(user_id, limit, page, max_date, min_date)
+        user_transactions = get_transactions_by_user_id(user_id, limit, page, max_date, min_date, cursor)
         
         # Checking if transactions exist for the user
         if user_transactions is None:
@@ -61,6 +70,9 @@ def get_all_user_transactions_controller():
         
         # Return user transactions if found
         return user_transactions
+    except ValueError as e:
+        # Return validation errors for bad dates or an invalid cursor
+        return {"errors": e.args[0]}, 422
     except DatabaseError as e:
         # Return error message and an empty data of list if database error occurs
         return {"error": str(e),"data":[]}, 404
@@ -69,6 +81,172 @@ def get_all_user_transactions_controller():
 
 
 
+# Columns of the CSV export, one row per transaction detail
+EXPORT_CSV_COLUMNS = [
+    "transaction_id", "user_id", "address", "fullname", "phone_number", "created_at",
+    "detail_id", "product_id", "product_price", "quantity", "sub_total",
+]
+
+
+def export_transactions_ndjson(batches):
+    """
+    Encode transaction batches as newline-delimited JSON, one transaction per line.
+    """
+    for batch in batches:
+        yield "".join(
+            json.dumps(transaction, default=lambda value: value.isoformat()) + "\n"
+            for transaction in batch
+        )
+
+
+def export_transactions_csv(batches):
+    """
+    Encode transaction batches as CSV, one row per transaction detail.
+
+    A transaction without details gets a single row with empty detail columns.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_CSV_COLUMNS)
+    for batch in batches:
+        for transaction in batch:
+            head = [
+                transaction["id"], transaction["user_id"], transaction["address"],
+                transaction["fullname"], transaction["phone_number"], transaction["created_at"].isoformat(),
+            ]
+            for detail in transaction["details"] or [{}]:
+                writer.writerow(head + [
+                    detail.get("id"), detail.get("product_id"), detail.get("product_price"),
+                    detail.get("quantity"), detail.get("sub_total"),
+                ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_transactions_controller():
+    """
+    Controller function to stream every transaction with its details to an admin.
+
+    Query Parameters:
+    - format: 'ndjson' (default) or 'csv'.
+    - min_date, max_date: Optional date range (YYYY-MM-DD).
+
+    Returns:
+        Response: A streamed response whose body is produced batch by batch from a
+        server-side cursor, so memory use does not grow with the number of transactions.
+        dict: An error message with a 403 status code for non-admins, or 422 for invalid parameters.
+    """
+    try:
+        if get_jwt_identity()["role"] != "admin":
+            return {"message": "Unauthorized"}, 403
+
+        export_format = request.args.get("format", "ndjson")
+        max_date = request.args.get("max_date")
+        min_date = request.args.get("min_date")
+        if export_format not in ("ndjson", "csv"):
+            raise ValueError({"format": ["Supported values: ndjson, csv"]})
+        if max_date and not validate_date_format(max_date):
+            raise ValueError({"max_date": ["Invalid date format. Use YYYY-MM-DD."]})
+        if min_date and not validate_date_format(min_date):
+            raise ValueError({"min_date": ["Invalid date format. Use YYYY-MM-DD."]})
+
+        batches = stream_transactions(max_date, min_date)
+        if export_format == "csv":
+            body, mimetype = export_transactions_csv(batches), "text/csv"
+        else:
+            body, mimetype = export_transactions_ndjson(batches), "application/x-ndjson"
+        # The request context, and with it the pooled connection, stays alive
+        # until the last batch has been sent
+        response = Response(stream_with_context(body), mimetype=mimetype)
+        response.headers["Content-Disposition"] = f"attachment; filename=transactions.{export_format}"
+        return response
+    except ValueError as e:
+        return {"errors": e.args[0]}, 422
+    except Exception as e:
+        raise e
+
+
+def stock_error_message(product_id):
+    """
+    Build the error message for a product whose stock could not be reserved.
+
+    Parameters:
+        product_id (int): The ID of the product.
+
+    Returns:
+        str: Message telling whether the product is missing or how many items are left.
+    """
+    products = get_products_by_ids([product_id])
+    if products["missing"]:
+        return f"Produk dengan ID {product_id} sedang kosong"
+    return f"Stok dari produk dengan ID {product_id} hanya tersisa {products['data'][0]['quantity']} barang"
+
+
+def checkout_errors_response(errors):
+    """
+    Build the error response for a checkout refused by the database function.
+
+    Parameters:
+        errors (list): The "errors" returned by checkout_transaction.
+
+    Returns:
+        tuple: The first problem as "error" and every problem as "items", with a 404 status code.
+    """
+    messages = []
+    for item in errors:
+        if "cart_id" in item:
+            messages.append(f"Cart dengan ID {item['cart_id']} tidak ditemukan")
+        elif item["error"] == "not_found":
+            messages.append(f"Produk dengan ID {item['product_id']} sedang kosong")
+        else:
+            messages.append(
+                f"Stok dari produk dengan ID {item['product_id']} hanya tersisa {item['available']} barang"
+            )
+    return {"error": messages[0], "items": errors}, 404
+
+
+def checkout_with_function(conn, user_id, address, fullname, phone_number, product_ids=None, quantities=None, cart_ids=None):
+    """
+    Check out through the checkout_transaction database function and commit.
+
+    Parameters:
+        conn (connection): The request's connection.
+        user_id (int): The ID of the user checking out.
+        address (str): The address associated with the transaction.
+        fullname (str): The full name associated with the transaction.
+        phone_number (str): The phone number associated with the transaction.
+        product_ids (list, optional): The IDs of the products bought.
+        quantities (list, optional): The quantity bought of each product.
+        cart_ids (list, optional): The IDs of the user's carts to check out instead.
+
+    Returns:
+        tuple or None: The response to send, or None when the function is not
+        installed and the caller should fall back to the Python checkout.
+    """
+    # Only the failed call is undone, not what the request already wrote
+    # (e.g. its idempotency key)
+    cur = conn.cursor()
+    try:
+        cur.execute("SAVEPOINT checkout_function")
+        result = checkout_transaction(user_id, address, fullname, phone_number, product_ids, quantities, cart_ids)
+    except psycopg2.errors.UndefinedFunction:
+        cur.execute("ROLLBACK TO SAVEPOINT checkout_function")
+        return None
+    finally:
+        cur.close()
+    if result["errors"]:
+        conn.rollback()
+        return checkout_errors_response(result["errors"])
+    response = {"message": "Berhasil ditambahkan", "transaction_id": result["transaction_id"]}, 200
+    store_idempotent_response(response)
+    conn.commit()
+    invalidate_product_cache(*result["product_ids"])
+    return response
+
+
 def add_user_transactions_controller():
     """
     Controller function to add transactions for a user.
@@ -77,6 +255,7 @@ def add_user_transactions_controller():
         dict: A dictionary containing a success message if the transaction is added successfully.
         dict: An error message with a 404 status code if there are issues with the transaction data.
     """
+    conn = get_conn()
     cur = conn.cursor()  # Initialize a cursor
     try:
         # Get user ID from JWT
@@ -92,40 +271,69 @@ def add_user_transactions_controller():
         if not form.validate():
             errors = {field.name: field.errors for field in form if field.errors}
             raise ValueError(errors)
+
+        # Parse the items
+        if not product_ids:
+            raise ValueError({"product_id": ["Please add at least one product"]})
+        if len(product_ids) != len(quantities):
+            raise ValueError({"quantity": ["Each product needs a quantity"]})
+        for product_id, quantity in zip(product_ids, quantities):
+            if not str(product_id).isdigit() or not str(quantity).isdigit() or int(quantity) < 1:
+                raise ValueError({"product_id": [f"Invalid product ID or quantity: {product_id}, {quantity}"]})
+        product_ids = [int(product_id) for product_id in product_ids]
+        quantities = [int(quantity) for quantity in quantities]
+
+        if CHECKOUT_MODE == "function":
+            response = checkout_with_function(
+                conn, user_id, address, fullname, phone_number,
+                product_ids=product_ids,
+                quantities=quantities,
+            )
+            if response is not None:
+                return response
+
+        # Load every product in one query and fail early, before writing
+        # anything, when one is missing or its stock is visibly short
+        products = get_products_by_ids(product_ids)
+        if products["missing"]:
+            raise DatabaseError(f"Produk dengan ID {products['missing'][0]} sedang kosong")
+        stocks = {product["id"]: product["quantity"] for product in products["data"]}
+        totals = {}
+        for product_id, quantity in zip(product_ids, quantities):
+            totals[product_id] = totals.get(product_id, 0) + quantity
+        for product_id, quantity in totals.items():
+            if stocks[product_id] < quantity:
+                raise DatabaseError(
+                    f"Stok dari produk dengan ID {product_id} hanya tersisa {stocks[product_id]} barang"
+                )
         
         # Begin a transaction
         transaction = add_transaction(user_id, address, fullname, phone_number)
+
+        # Take every product out of stock in one statement, only if enough is left
+        reserved = reserve_products_stock(totals)
+        for product_id in totals:
+            if product_id not in reserved:
+                raise DatabaseError(stock_error_message(product_id))
+
+        # Add all transaction details in one insert
+        details = []
+        for product_id, quantity in zip(product_ids, quantities):
+            product_price = reserved[product_id]["price"]
+            details.append({
+                "product_id": product_id,
+                "product_price": product_price,
+                "quantity": quantity,
+                "sub_total": product_price * quantity,
+            })
+        add_transaction_details_bulk(transaction, details)
         
-        # Add transaction details for each product
-        for i in range(len(product_ids)):
-            product_id = product_ids[i]
-            quantity = int(quantities[i])
-            products = get_product_by_id(product_id)
-            
-            # Check if the product exists
-            if products is None:
-                raise DatabaseError(f"Produk dengan ID {product_id} sedang kosong")
-            
-            # Check if there is enough quantity of the product
-            if int(products["quantity"]) < quantity:
-                raise DatabaseError(
-                    f"Stok dari produk dengan ID {product_id} hanya tersisa {products['quantity']} barang"
-                )
-            
-            # Calculate subtotal and add transaction details
-            sub_total = products["price"] * quantity
-            product_price = products["price"]
-            add_transaction_details(
-                transaction, product_id, product_price, quantity, sub_total
-            )
-            
-            # Update the quantity of the product
-            updated_quantity = products["quantity"] - quantity
-            update_product_quantity(product_id, updated_quantity)
-        
+        response = {"message": "Berhasil ditambahkan"}, 200
+        store_idempotent_response(response)
         # Commit the transaction
         conn.commit()
-        return {"message": "Berhasil ditambahkan"}, 200
+        invalidate_product_cache(*totals)
+        return response
 
     except ValueError as e:
         # Rollback transaction and return error message for value error
@@ -137,7 +345,8 @@ def add_user_transactions_controller():
         return {"error": str(e)}, 404
     except Exception as e:
         # Rollback transaction and raise exception for other errors
-        conn.rollback()
+        if not conn.closed:
+            conn.rollback()
         raise e
     finally:
         # Close the cursor
@@ -154,6 +363,7 @@ def add_transaction_from_carts_controller():
         dict: A dictionary containing a success message if the transaction is added successfully.
         dict: An error message with a 404 status code if there are issues with the transaction data.
     """
+    conn = get_conn()
     cur = conn.cursor()  # Initialize a cursor
     try:
         user_id = get_jwt_identity()["id"]  # Get user ID from JWT
@@ -165,45 +375,68 @@ def add_transaction_from_carts_controller():
         if not form.validate():
             errors = {field.name: field.errors for field in form if field.errors}
             raise ValueError(errors)
+        # Parse the cart IDs, ignoring duplicates
+        if not cart_ids:
+            raise ValueError({"cart_ids": ["Please select at least one cart"]})
         for cart_id in cart_ids:
-            if not isinstance(cart_id, int):
+            if not str(cart_id).isdigit():
                 raise ValueError(f"Invalid cart ID: {cart_id} (must be an integer)")
-            break
-        # Begin a transaction
-        transaction = add_transaction(user_id, address, fullname, phone_number)
-        
-        # Add transaction details from each cart
+        cart_ids = sorted(set(int(cart_id) for cart_id in cart_ids))
+
+        if CHECKOUT_MODE == "function":
+            response = checkout_with_function(conn, user_id, address, fullname, phone_number, cart_ids=cart_ids)
+            if response is not None:
+                return response
+
+        # Load every selected cart with its product in one query
+        carts = get_carts_with_products(cart_ids, user_id)
+        found = set(cart["id"] for cart in carts)
         for cart_id in cart_ids:
-            cart = get_cart_by_cart_id_and_user_id(cart_id, user_id)
-            
-            # Check if the cart exists
-            if cart is None:
+            if cart_id not in found:
                 raise DatabaseError(f"Cart dengan ID {cart_id} tidak ditemukan")
-            
-            product = get_product_by_id(cart["product_id"])
-            quantity = int(cart["quantity"])
-            
-            # Check if there is enough quantity of the product
-            if int(product["quantity"]) < quantity:
+
+        # Quantities to take out of stock, per product
+        quantities = {}
+        stocks = {}
+        for cart in carts:
+            quantities[cart["product_id"]] = quantities.get(cart["product_id"], 0) + int(cart["quantity"])
+            stocks[cart["product_id"]] = cart["stock"]
+        # Fail early, before writing anything, when the stock is visibly short
+        for product_id, quantity in quantities.items():
+            if stocks[product_id] < quantity:
                 raise DatabaseError(
-                    f"Stok dari produk dengan ID {product['id']} hanya tersisa {product['quantity']} barang"
+                    f"Stok dari produk dengan ID {product_id} hanya tersisa {stocks[product_id]} barang"
                 )
-            
-            # Calculate subtotal and add transaction details
-            sub_total = product["price"] * quantity
-            product_price = product["price"]
-            add_transaction_details(
-                transaction, product["id"], product_price, quantity, sub_total
-            )
-            
-            # Update the quantity of the product and delete the cart
-            updated_quantity = product["quantity"] - quantity
-            update_product_quantity(product["id"], updated_quantity)
-            delete_cart_by_id(cart_id)
+
+        # Begin a transaction
+        transaction = add_transaction(user_id, address, fullname, phone_number)
+
+        # Take every product out of stock in one statement, only if enough is left
+        reserved = reserve_products_stock(quantities)
+        for product_id in quantities:
+            if product_id not in reserved:
+                raise DatabaseError(stock_error_message(product_id))
+
+        # Add all transaction details in one insert and clear the carts in one delete
+        details = []
+        for cart in carts:
+            quantity = int(cart["quantity"])
+            product_price = reserved[cart["product_id"]]["price"]
+            details.append({
+                "product_id": cart["product_id"],
+                "product_price": product_price,
+                "quantity": quantity,
+                "sub_total": product_price * quantity,
+            })
+        add_transaction_details_bulk(transaction, details)
+        delete_carts_by_ids(cart_ids, user_id)
         
+        response = {"message": "Berhasil ditambahkan"}, 200
+        store_idempotent_response(response)
         # Commit the transaction
         conn.commit()
-        return {"message": "Berhasil ditambahkan"}, 200
+        invalidate_product_cache(*quantities)
+        return response
     
     except DatabaseError as a:
         # Rollback transaction and return error message for database error
@@ -215,7 +448,8 @@ def add_transaction_from_carts_controller():
         return {"errors": v.args[0]}, 404
     except Exception as e:
         # Rollback transaction and raise exception for other errors
-        conn.rollback()
+        if not conn.closed:
+            conn.rollback()
         raise e
     finally:
         # Close the cursor
@@ -238,7 +472,9 @@ def delete_user_transaction_controller():
     
     except Exception as e:
         # Rollback transaction and return error message for other errors
-        conn.rollback()
+        conn = get_conn()
+        if not conn.closed:
+            conn.rollback()
         raise e
 
 
@@ -1,9 +1,305 @@
-import psycopg2, os
-
-conn = psycopg2.connect(
-    host=os.getenv("DB_HOST"),
-    port=os.getenv("DB_PORT"),
-    database=os.getenv("DB_NAME"),
-    user=os.getenv("DB_USER"),
-    password=os.getenv("DB_PASS")
-    )
\ No newline at end of file
+import psycopg2, os, threading, time, functools
+from psycopg2 import pool, extensions
+from flask import g
+from errors import DatabaseUnavailable
+
+# Pool sizing. psycopg2 keeps at most DB_POOL_MIN idle connections around and
+# opens extra ones on demand up to DB_POOL_MAX.
+POOL_MIN = int(os.getenv("DB_POOL_MIN", 2))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+# Seconds to wait for a free connection before giving up.
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+# Connections idle for longer than this are pinged before being handed out.
+POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", 30))
+# Read queries interrupted by a lost connection are retried this many times,
+# waiting DB_RETRY_BACKOFF seconds and doubling up to DB_RETRY_BACKOFF_MAX.
+READ_RETRIES = int(os.getenv("DB_READ_RETRIES", 3))
+RETRY_BACKOFF = float(os.getenv("DB_RETRY_BACKOFF", 0.1))
+RETRY_BACKOFF_MAX = float(os.getenv("DB_RETRY_BACKOFF_MAX", 1))
+
+
+def connect():
+    """
+    Open a new standalone connection using the DB_* environment variables.
+
+    Returns:
+        connection: A new psycopg2 connection that is not managed by the pool.
+    """
+    return psycopg2.connect(**_connect_kwargs())
+
+
+def _connect_kwargs():
+    return {
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT"),
+        "database": os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASS"),
+    }
+
+
+# The pool is created lazily by the first get_conn() in each process, so
+# importing the app (e.g. gunicorn --preload) opens no sockets in the master.
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# psycopg2's pool raises instead of waiting when it is exhausted, so the slots
+# semaphore makes callers queue for up to POOL_TIMEOUT seconds.
+_slots = threading.BoundedSemaphore(POOL_MAX)
+_last_used = {}
+# Pools inherited from a parent process. They are kept referenced and never
+# closed: closing (or garbage collecting) them would send a Terminate message
+# over sockets that still belong to the parent.
+_orphaned = []
+
+
+def _get_pool():
+    """
+    Return this process's connection pool, creating it on first use.
+
+    A pool created before a fork is orphaned in the child and replaced by a new
+    one, so every worker process talks to Postgres over its own sockets.
+    """
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool_pid != os.getpid():
+            _forget_pool()
+        if _pool is None:
+            _pool = pool.ThreadedConnectionPool(POOL_MIN, POOL_MAX, **_connect_kwargs())
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _forget_pool():
+    global _pool, _pool_pid, _slots, _last_used
+    if _pool is not None:
+        _orphaned.append(_pool)
+    _pool = None
+    _pool_pid = os.getpid()
+    _slots = threading.BoundedSemaphore(POOL_MAX)
+    _last_used = {}
+
+
+def reset_after_fork():
+    """
+    Forget the connection state inherited from a parent process.
+
+    Runs automatically in forked children and is also safe to call from a
+    server's post-fork hook. The next get_conn() opens a fresh pool.
+    """
+    global _pool_lock
+    # The parent may have forked while another thread held the lock.
+    _pool_lock = threading.Lock()
+    _forget_pool()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def _is_healthy(conn):
+    """
+    Check that a pooled connection can still be used.
+
+    Closed connections and connections whose server state is unknown are
+    rejected straight away; connections that sat idle for longer than
+    POOL_PING_AFTER are additionally pinged with a cheap query.
+    """
+    if conn.closed:
+        return False
+    if conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0) >= POOL_PING_AFTER:
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+    return True
+
+
+def _discard(conn):
+    _last_used.pop(id(conn), None)
+    _get_pool().putconn(conn, close=True)
+
+
+def _checkout():
+    # Resolve the pool first so a stale, pre-fork pool and its slots are reset
+    # before this process starts waiting on them.
+    conn_pool = _get_pool()
+    if not _slots.acquire(timeout=POOL_TIMEOUT):
+        raise pool.PoolError(f"no database connection available after {POOL_TIMEOUT} seconds")
+    try:
+        # Every unhealthy connection is closed on the way, so after POOL_MAX
+        # attempts the pool is handing out freshly opened connections.
+        for _ in range(POOL_MAX + 1):
+            conn = conn_pool.getconn()
+            if _is_healthy(conn):
+                return conn
+            _discard(conn)
+        raise pool.PoolError("could not obtain a healthy database connection")
+    except Exception:
+        _slots.release()
+        raise
+
+
+def get_conn():
+    """
+    Return the database connection bound to the current Flask app context.
+
+    The first call within a request checks a connection out of the pool; later
+    calls in the same request return that same connection, so a controller can
+    run several model functions inside one transaction and commit once.
+
+    Returns:
+        connection: The psycopg2 connection for the current request.
+    """
+    if "db_conn" not in g:
+        g.db_conn = _checkout()
+    return g.db_conn
+
+
+def release_conn(exception=None):
+    """
+    Return the current app context's connection to the pool.
+
+    Registered as an app-context teardown handler by init_app. Uncommitted work
+    is rolled back by the pool, and broken connections are closed instead of
+    being reused.
+    """
+    conn = g.pop("db_conn", None)
+    if conn is None:
+        return
+    try:
+        if conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            _discard(conn)
+        else:
+            _last_used[id(conn)] = time.monotonic()
+            _get_pool().putconn(conn)
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        # The rollback done by putconn failed, the socket is gone.
+        _discard(conn)
+    finally:
+        _slots.release()
+
+
+def init_app(app):
+    """
+    Register the pool teardown and error handlers on a Flask application.
+
+    Parameters:
+        app (Flask): The application whose requests use pooled connections.
+    """
+    app.teardown_appcontext(release_conn)
+    app.register_error_handler(DatabaseUnavailable, _database_unavailable)
+
+
+def _database_unavailable(e):
+    return {"error": str(e)}, 503
+
+
+# RECONNECT AND RETRY
+
+_stats = {"reconnects": 0, "retries": 0, "write_failures": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    """
+    Return the reconnect and retry counters of this process.
+
+    Returns:
+        dict: A dictionary with the following keys:
+        - "reconnects" (int): Connections dropped after being found broken mid-query.
+        - "retries" (int): Read queries that were run again on a new connection.
+        - "write_failures" (int): Write queries aborted because the connection was lost.
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _connection_lost(conn):
+    return bool(conn.closed) or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN
+
+
+def _drop_conn():
+    """
+    Throw away the current app context's broken connection.
+
+    The next get_conn() in the same request checks out a new one.
+    """
+    conn = g.pop("db_conn", None)
+    if conn is None:
+        return
+    _count("reconnects")
+    try:
+        _discard(conn)
+    finally:
+        _slots.release()
+
+
+def read_query(func):
+    """
+    Decorate a model function that only reads.
+
+    If the connection turns out to be lost, it is replaced and the function is
+    run again with exponential backoff, up to READ_RETRIES times. A read that
+    happens inside an open transaction is not retried, because the earlier
+    statements of that transaction died with the connection.
+
+    Raises:
+        DatabaseUnavailable: If the connection is lost and the read cannot be retried.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        attempt = 0
+        while True:
+            conn = get_conn()
+            retryable = conn.info.transaction_status == extensions.TRANSACTION_STATUS_IDLE
+            try:
+                return func(*args, **kwargs)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if not _connection_lost(conn):
+                    raise
+                _drop_conn()
+                if not retryable or attempt >= READ_RETRIES:
+                    raise DatabaseUnavailable("Database connection lost, please try again") from e
+            attempt += 1
+            _count("retries")
+            time.sleep(min(RETRY_BACKOFF * 2 ** (attempt - 1), RETRY_BACKOFF_MAX))
+
+    return wrapper
+
+
+def write_query(func):
+    """
+    Decorate a model function that writes.
+
+    Writes are never retried, since the server may already have applied them.
+    A lost connection is replaced for later queries and reported to the caller.
+
+    Raises:
+        DatabaseUnavailable: If the connection is lost while writing.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        conn = get_conn()
+        try:
+            return func(*args, **kwargs)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if not _connection_lost(conn):
+                raise
+            _drop_conn()
+            _count("write_failures")
+            raise DatabaseUnavailable("Database connection lost, the change was not saved") from e
+
+    return wrapper
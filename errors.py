@@ -37,3 +37,13 @@ class DatabaseError(Exception):
     """
     def __init__(self, message):
         super().__init__(message)
+
+class DatabaseUnavailable(Exception):
+    """
+    Exception raised when the database connection is lost and the query cannot be retried.
+
+    Args:
+        message (str): The error message to be displayed.
+    """
+    def __init__(self, message):
+        super().__init__(message)
@@ -179,6 +179,33 @@ class add_product_form(Form):
     )
 
 
+class update_product_stock_form(Form):
+    """
+    Form for one item of a bulk price and stock update.
+
+    Fields:
+        id (IntegerField): ID of the product to update.
+        price (IntegerField, optional): New price of the product.
+        quantity (IntegerField, optional): New quantity in stock, 0 when sold out.
+
+    Validation:
+        - Numeric validation for id, price and quantity, within the bounds of add_product_form.
+    """
+
+    id = IntegerField(
+        "id",
+        [validators.NumberRange(min=1, max=2147483647, message="id must be number")],
+    )
+    price = IntegerField(
+        "price",
+        [validators.Optional(), validators.NumberRange(min=1, max=1000000, message="price must be number")],
+    )
+    quantity = IntegerField(
+        "quantity",
+        [validators.Optional(), validators.NumberRange(min=0, max=200, message="quantity must be number")],
+    )
+
+
 # TRANSACTION
 class get_transaction_form(Form):
     """
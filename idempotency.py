@@ -0,0 +1,118 @@
+import functools, hashlib, json, os, threading, time
+from flask import request, make_response, g
+from flask_jwt_extended import get_jwt_identity
+from models.idempotency import (
+    claim_idempotency_key,
+    save_idempotent_response,
+    release_idempotency_key,
+    purge_idempotency_keys,
+)
+
+# Seconds between two purges of expired keys by the same worker.
+IDEMPOTENCY_PURGE_INTERVAL = int(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", 3600))
+
+_purged_at = 0.0
+_purge_lock = threading.Lock()
+
+
+def request_fingerprint():
+    """
+    Hash what identifies the current request: its method, path and form data.
+
+    Returns:
+        str: A hex SHA-256 digest.
+    """
+    payload = json.dumps(
+        {"method": request.method, "path": request.path, "form": request.form.to_dict(flat=False)},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def purge_expired_keys():
+    """
+    Purge expired idempotency keys, at most once every IDEMPOTENCY_PURGE_INTERVAL
+    seconds per worker.
+
+    Returns:
+        None
+    """
+    global _purged_at
+    with _purge_lock:
+        if time.monotonic() - _purged_at < IDEMPOTENCY_PURGE_INTERVAL:
+            return
+        _purged_at = time.monotonic()
+    purge_idempotency_keys()
+
+
+def store_idempotent_response(response):
+    """
+    Store a view's response under the Idempotency-Key of the current request.
+
+    Checkout controllers call this right before committing, so the response is
+    committed in the same transaction as the checkout and its key. Does nothing
+    when the request has no Idempotency-Key.
+
+    Parameters:
+        response (tuple): The (body, status_code) pair the view is about to return.
+
+    Returns:
+        None
+    """
+    claim = g.get("idempotency_claim")
+    if claim is None:
+        return
+    body, status_code = response
+    save_idempotent_response(claim[0], claim[1], status_code, body)
+
+
+def idempotent(view):
+    """
+    Decorate a JWT protected POST view so it honours an Idempotency-Key header.
+
+    The first request with a key runs the view; its key and, through
+    store_idempotent_response, its successful response are committed together
+    with the view's own transaction.
+    Replays of that request get the stored response back without running the
+    view again. Failed requests are not stored, so they can be retried with
+    the same key. Requests without the header are handled as usual.
+
+    Parameters:
+        view (callable): The Flask view function to wrap.
+
+    Returns:
+        callable: The wrapped view.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return {"errors": {"Idempotency-Key": ["Field cannot be longer than 255 characters."]}}, 422
+
+        purge_expired_keys()
+        user_id = get_jwt_identity()["id"]
+        fingerprint = request_fingerprint()
+        earlier = claim_idempotency_key(user_id, key, request.path, fingerprint)
+        if earlier is not None:
+            if earlier["fingerprint"] != fingerprint:
+                return {"error": "Idempotency-Key sudah dipakai untuk request yang berbeda"}, 422
+            if earlier["response"] is None:
+                response = make_response({"error": "Request dengan Idempotency-Key ini masih diproses"}, 409)
+                response.headers["Retry-After"] = "1"
+                return response
+            response = make_response(earlier["response"], earlier["status_code"])
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+
+        g.idempotency_claim = (user_id, key)
+        try:
+            response = make_response(view(*args, **kwargs))
+        finally:
+            g.pop("idempotency_claim", None)
+        if response.status_code != 200:
+            release_idempotency_key(user_id, key)
+        return response
+
+    return wrapper
@@ -0,0 +1,198 @@
+"""
+Versioned schema migrations.
+
+Migrations live in the migrations/ directory as pairs of SQL files named
+<version>_<name>.up.sql and <version>_<name>.down.sql. Applied versions are
+recorded in the schema_migrations table. A migration without a down file,
+like the initial schema, cannot be rolled back.
+
+Usage:
+    python migrate.py status
+    python migrate.py apply [version]
+    python migrate.py rollback [steps]
+"""
+import os, re, sys
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+_FILENAME = re.compile(r"^(\d{4})_(\w+)\.(up|down)\.sql$")
+
+
+def load_migrations():
+    """
+    Read the migration files from MIGRATIONS_DIR.
+
+    Returns:
+        list: A list of dictionaries sorted by version, with the following keys:
+        - "version" (str): Four digit version number.
+        - "name" (str): Migration name.
+        - "up" (str): SQL applying the migration.
+        - "down" (str or None): SQL reverting the migration, if provided.
+    """
+    migrations = {}
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = _FILENAME.match(filename)
+        if not match:
+            continue
+        version, name, direction = match.groups()
+        with open(os.path.join(MIGRATIONS_DIR, filename), encoding="utf-8") as f:
+            sql = f.read()
+        migration = migrations.setdefault(version, {"version": version, "name": name, "up": None, "down": None})
+        migration[direction] = sql
+    for migration in migrations.values():
+        if migration["up"] is None:
+            raise ValueError(f"Migration {migration['version']} has no .up.sql file")
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def _ensure_table(conn):
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version VARCHAR(4) PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT now()
+            )
+        """
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        cur.close()
+
+
+def applied_versions(conn):
+    """
+    Retrieve the applied migrations.
+
+    Parameters:
+        conn (connection): A psycopg2 connection.
+
+    Returns:
+        dict: A dictionary mapping applied versions to their applied_at timestamp.
+    """
+    _ensure_table(conn)
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT version, applied_at FROM schema_migrations ORDER BY version")
+        rows = cur.fetchall()
+        conn.commit()
+        return {row[0]: row[1] for row in rows}
+    finally:
+        cur.close()
+
+
+def status(conn):
+    """
+    List every known migration together with its state.
+
+    Parameters:
+        conn (connection): A psycopg2 connection.
+
+    Returns:
+        list: A list of dictionaries with "version", "name" and "applied_at" (None if pending).
+    """
+    applied = applied_versions(conn)
+    return [
+        {"version": m["version"], "name": m["name"], "applied_at": applied.get(m["version"])}
+        for m in load_migrations()
+    ]
+
+
+def apply(conn, target: str = None):
+    """
+    Apply pending migrations in version order, each in its own transaction.
+
+    Parameters:
+        conn (connection): A psycopg2 connection.
+        target (str, optional): Stop after this version. Defaults to the latest one.
+
+    Returns:
+        list: The versions that were applied.
+    """
+    applied = applied_versions(conn)
+    done = []
+    for migration in load_migrations():
+        if target is not None and migration["version"] > target:
+            break
+        if migration["version"] in applied:
+            continue
+        cur = conn.cursor()
+        try:
+            cur.execute(migration["up"])
+            cur.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (migration["version"], migration["name"]),
+            )
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            cur.close()
+        done.append(migration["version"])
+    return done
+
+
+def rollback(conn, steps: int = 1):
+    """
+    Revert the most recently applied migrations.
+
+    Parameters:
+        conn (connection): A psycopg2 connection.
+        steps (int, optional): How many migrations to revert. Defaults to 1.
+
+    Returns:
+        list: The versions that were reverted.
+    """
+    applied = applied_versions(conn)
+    migrations = {m["version"]: m for m in load_migrations()}
+    done = []
+    for version in sorted(applied, reverse=True)[:steps]:
+        migration = migrations.get(version)
+        if migration is None or migration["down"] is None:
+            raise ValueError(f"Migration {version} cannot be rolled back")
+        cur = conn.cursor()
+        try:
+            cur.execute(migration["down"])
+            cur.execute("DELETE FROM schema_migrations WHERE version = %s", (version,))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            cur.close()
+        done.append(version)
+    return done
+
+
+def main(argv):
+    from dotenv import load_dotenv
+    load_dotenv()
+    from db import connect
+
+    if not argv or argv[0] not in ("status", "apply", "rollback"):
+        print(__doc__.strip())
+        return 1
+    conn = connect()
+    try:
+        if argv[0] == "status":
+            for migration in status(conn):
+                state = migration["applied_at"] or "pending"
+                print(f"{migration['version']}  {migration['name']:<30} {state}")
+        elif argv[0] == "apply":
+            versions = apply(conn, argv[1] if len(argv) > 1 else None)
+            print("Applied: " + (", ".join(versions) or "nothing to apply"))
+        else:
+            versions = rollback(conn, int(argv[1]) if len(argv) > 1 else 1)
+            print("Rolled back: " + (", ".join(versions) or "nothing to roll back"))
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
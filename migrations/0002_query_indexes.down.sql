@@ -0,0 +1,7 @@
+DROP INDEX IF EXISTS products_name_trgm_idx;
+DROP INDEX IF EXISTS products_category_id_price_idx;
+DROP INDEX IF EXISTS users_email_idx;
+DROP INDEX IF EXISTS transactions_user_id_created_at_idx;
+DROP INDEX IF EXISTS transaction_details_transaction_id_idx;
+DROP INDEX IF EXISTS product_images_product_id_idx;
+DROP INDEX IF EXISTS carts_user_id_product_id_idx;
@@ -0,0 +1,23 @@
+-- Indexes backing the lookups done in models/.
+
+-- get_carts_by_user_id, get_carts_by_user_id_and_product_id
+CREATE INDEX IF NOT EXISTS carts_user_id_product_id_idx ON carts (user_id, product_id);
+
+-- get_all_product_images, delete_images_by_product_id
+CREATE INDEX IF NOT EXISTS product_images_product_id_idx ON product_images (product_id);
+
+-- get_transaction_details_by_transaction_id
+CREATE INDEX IF NOT EXISTS transaction_details_transaction_id_idx ON transaction_details (transaction_id);
+
+-- get_transactions_by_user_id with the created_at range filters
+CREATE INDEX IF NOT EXISTS transactions_user_id_created_at_idx ON transactions (user_id, created_at);
+
+-- find_email, find_email_password
+CREATE INDEX IF NOT EXISTS users_email_idx ON users (email);
+
+-- get_products_by_category and the category/price filters of get_all_products
+CREATE INDEX IF NOT EXISTS products_category_id_price_idx ON products (category_id, price);
+
+-- keyword search in get_all_products (p.name ilike '%keyword%')
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS products_name_trgm_idx ON products USING gin (name gin_trgm_ops);
@@ -0,0 +1,2 @@
+DROP INDEX IF EXISTS products_search_vector_idx;
+ALTER TABLE products DROP COLUMN IF EXISTS search_vector;
@@ -0,0 +1,12 @@
+-- Full-text search over product name (weight A) and description (weight B).
+-- Both the 'simple' and 'indonesian' lexemes are stored so a query can use
+-- either dictionary against the same column and index.
+ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple'::regconfig, coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('simple'::regconfig, coalesce(description, '')), 'B') ||
+        setweight(to_tsvector('indonesian'::regconfig, coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('indonesian'::regconfig, coalesce(description, '')), 'B')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS products_search_vector_idx ON products USING gin (search_vector);
@@ -0,0 +1,10 @@
+-- Single-row version counter of the catalog (products, categories, product
+-- images). The application bumps it after committing a catalog write and
+-- uses it as the ETag / Last-Modified of catalog responses.
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+INSERT INTO catalog_version (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1 @@
+DROP FUNCTION IF EXISTS checkout_transaction(INTEGER, VARCHAR, VARCHAR, VARCHAR, INTEGER[], INTEGER[], INTEGER[]);
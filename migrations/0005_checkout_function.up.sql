@@ -0,0 +1,95 @@
+-- Whole checkout in one round trip: validate stock, create the transaction,
+-- write its details, take the stock and clear the carts. Either the carts
+-- (p_cart_ids) or explicit product/quantity pairs are checked out.
+--
+-- Returns {"transaction_id": id, "product_ids": [...], "errors": []} on
+-- success. When some items cannot be checked out nothing is written and
+-- transaction_id is null, with one entry per problem in "errors":
+--   {"cart_id": id, "error": "not_found"}
+--   {"product_id": id, "requested": n, "available": n, "error": "not_found" | "insufficient_stock"}
+-- The caller commits.
+CREATE OR REPLACE FUNCTION checkout_transaction(
+    p_user_id INTEGER,
+    p_address VARCHAR,
+    p_fullname VARCHAR,
+    p_phone_number VARCHAR,
+    p_product_ids INTEGER[],
+    p_quantities INTEGER[],
+    p_cart_ids INTEGER[] DEFAULT NULL
+) RETURNS JSONB
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_transaction_id INTEGER;
+    v_errors JSONB;
+BEGIN
+    IF p_cart_ids IS NOT NULL THEN
+        SELECT coalesce(jsonb_agg(jsonb_build_object('cart_id', r.cart_id, 'error', 'not_found') ORDER BY r.cart_id), '[]'::jsonb)
+        INTO v_errors
+        FROM unnest(p_cart_ids) AS r(cart_id)
+        WHERE NOT EXISTS (SELECT 1 FROM carts c WHERE c.id = r.cart_id AND c.user_id = p_user_id);
+        IF jsonb_array_length(v_errors) > 0 THEN
+            RETURN jsonb_build_object('transaction_id', NULL, 'product_ids', '[]'::jsonb, 'errors', v_errors);
+        END IF;
+
+        SELECT array_agg(c.product_id ORDER BY c.id), array_agg(c.quantity ORDER BY c.id)
+        INTO p_product_ids, p_quantities
+        FROM carts c
+        WHERE c.id = ANY(p_cart_ids) AND c.user_id = p_user_id;
+    END IF;
+
+    IF coalesce(cardinality(p_product_ids), 0) = 0
+        OR cardinality(p_product_ids) <> cardinality(p_quantities) THEN
+        RAISE EXCEPTION 'checkout_transaction needs one quantity per product';
+    END IF;
+
+    -- Lock the products in ID order so concurrent checkouts cannot deadlock
+    PERFORM 1 FROM products WHERE id = ANY(p_product_ids) ORDER BY id FOR UPDATE;
+
+    SELECT coalesce(jsonb_agg(jsonb_build_object(
+               'product_id', l.product_id,
+               'requested', l.quantity,
+               'available', coalesce(p.quantity, 0),
+               'error', CASE WHEN p.id IS NULL THEN 'not_found' ELSE 'insufficient_stock' END
+           ) ORDER BY l.product_id), '[]'::jsonb)
+    INTO v_errors
+    FROM (
+        SELECT t.product_id, sum(t.quantity) AS quantity
+        FROM unnest(p_product_ids, p_quantities) AS t(product_id, quantity)
+        GROUP BY t.product_id
+    ) l
+    LEFT JOIN products p ON p.id = l.product_id
+    WHERE p.id IS NULL OR p.quantity < l.quantity;
+    IF jsonb_array_length(v_errors) > 0 THEN
+        RETURN jsonb_build_object('transaction_id', NULL, 'product_ids', '[]'::jsonb, 'errors', v_errors);
+    END IF;
+
+    INSERT INTO transactions (user_id, address, fullname, phone_number, created_at)
+    VALUES (p_user_id, p_address, p_fullname, p_phone_number, now())
+    RETURNING id INTO v_transaction_id;
+
+    INSERT INTO transaction_details (transaction_id, product_id, product_price, quantity, sub_total)
+    SELECT v_transaction_id, t.product_id, p.price, t.quantity, p.price * t.quantity
+    FROM unnest(p_product_ids, p_quantities) WITH ORDINALITY AS t(product_id, quantity, n)
+    JOIN products p ON p.id = t.product_id
+    ORDER BY t.n;
+
+    UPDATE products p
+    SET quantity = p.quantity - l.quantity
+    FROM (
+        SELECT t.product_id, sum(t.quantity) AS quantity
+        FROM unnest(p_product_ids, p_quantities) AS t(product_id, quantity)
+        GROUP BY t.product_id
+    ) l
+    WHERE p.id = l.product_id;
+
+    IF p_cart_ids IS NOT NULL THEN
+        DELETE FROM carts WHERE id = ANY(p_cart_ids) AND user_id = p_user_id;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'transaction_id', v_transaction_id,
+        'product_ids', (SELECT jsonb_agg(DISTINCT t.product_id) FROM unnest(p_product_ids) AS t(product_id)),
+        'errors', '[]'::jsonb
+    );
+END;
+$$;
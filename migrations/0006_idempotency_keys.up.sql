@@ -0,0 +1,15 @@
+-- Responses of checkout requests sent with an Idempotency-Key header. A row
+-- is inserted in the same transaction as the checkout it guards, so it only
+-- exists once that checkout committed; response is filled in right after.
+CREATE TABLE idempotency_keys (
+    user_id INTEGER NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    endpoint VARCHAR(255) NOT NULL,
+    fingerprint CHAR(64) NOT NULL,
+    status_code INTEGER,
+    response JSONB,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (user_id, key)
+);
+
+CREATE INDEX idx_idempotency_keys_created_at ON idempotency_keys (created_at);
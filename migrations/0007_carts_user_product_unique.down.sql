@@ -0,0 +1,2 @@
+ALTER TABLE carts DROP CONSTRAINT IF EXISTS carts_user_id_product_id_key;
+CREATE INDEX IF NOT EXISTS carts_user_id_product_id_idx ON carts (user_id, product_id);
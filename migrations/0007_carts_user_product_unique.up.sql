@@ -0,0 +1,24 @@
+-- One cart row per user and product, so add-to-cart can upsert on it.
+-- Duplicates left by concurrent add-to-cart requests are collapsed first
+-- into the oldest row, which gets the quantities of all of them, capped at
+-- the product's stock (but never below what the oldest row already had).
+UPDATE carts c
+SET quantity = LEAST(d.total, GREATEST(p.quantity, c.quantity))
+FROM (
+    SELECT min(id) AS id, sum(quantity) AS total
+    FROM carts
+    GROUP BY user_id, product_id
+    HAVING count(*) > 1
+) d, products p
+WHERE c.id = d.id
+  AND p.id = c.product_id;
+
+DELETE FROM carts c
+USING carts older
+WHERE older.user_id = c.user_id
+  AND older.product_id = c.product_id
+  AND older.id < c.id;
+
+-- The unique constraint's index replaces the plain one from 0002
+DROP INDEX IF EXISTS carts_user_id_product_id_idx;
+ALTER TABLE carts ADD CONSTRAINT carts_user_id_product_id_key UNIQUE (user_id, product_id);
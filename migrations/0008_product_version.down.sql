@@ -0,0 +1,3 @@
+DROP TRIGGER IF EXISTS products_bump_version ON products;
+DROP FUNCTION IF EXISTS products_bump_version();
+ALTER TABLE products DROP COLUMN IF EXISTS version, DROP COLUMN IF EXISTS updated_at;
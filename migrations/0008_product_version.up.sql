@@ -0,0 +1,22 @@
+-- Row version and last modification time of every product, for optimistic
+-- concurrency (If-Match) on product updates. The trigger bumps both on every
+-- UPDATE, whichever code path issues it. updated_at starts from created_at,
+-- which update_product used to overwrite on every edit.
+ALTER TABLE products
+    ADD COLUMN version INTEGER NOT NULL DEFAULT 1,
+    ADD COLUMN updated_at TIMESTAMP NOT NULL DEFAULT now();
+
+UPDATE products SET updated_at = created_at;
+
+CREATE OR REPLACE FUNCTION products_bump_version() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    NEW.updated_at := now();
+    RETURN NEW;
+END;
+$$;
+
+CREATE TRIGGER products_bump_version
+    BEFORE UPDATE ON products
+    FOR EACH ROW EXECUTE FUNCTION products_bump_version();
@@ -2,4 +2,6 @@ from models.products import *
 from models.users import *
 from models.categories import *
 from models.carts import *
-from models.transactions import *
\ No newline at end of file
+from models.transactions import *
+from models.catalog import *
+from models.idempotency import *
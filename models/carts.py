@@ -1,6 +1,8 @@
-from db import conn
+from db import get_conn, read_query, write_query
+from pagination import decode_cursor, keyset, keyset_page
 
-def get_all_carts(page: int, limit: int, max_date: int, min_date: int):
+@read_query
+def get_all_carts(page: int, limit: int, max_date: int, min_date: int, cursor: str = None):
     """
     Retrieve all carts based on pagination and optional date range filters.
 
@@ -9,15 +11,19 @@ def get_all_carts(page: int, limit: int, max_date: int, min_date: int):
         limit (int): The maximum number of carts per page.
         max_date (int): The maximum date (timestamp) for filtering carts.
         min_date (int): The minimum date (timestamp) for filtering carts.
+        cursor (str, optional): Keyset pagination cursor. When not None, `page` is ignored and
+            carts are fetched after the ID encoded in the cursor ('' starts at the first one).
 
     Returns:
         list or None: A list of dictionaries containing cart information if carts are found, otherwise None.
+        In cursor mode a dictionary {"data": list, "next_cursor": str or None} is returned instead.
         Each dictionary contains the following keys:
         - "id" (int): Cart ID.
         - "user_id" (int): User ID associated with the cart.
         - "product_id" (int): Product ID in the cart.
         - "quantity" (int): Quantity of the product in the cart.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         page = int(page)
@@ -44,9 +50,20 @@ def get_all_carts(page: int, limit: int, max_date: int, min_date: int):
         else:
             where = ""
         
+        # Keyset pagination: seek past the last cart ID of the previous page instead of using OFFSET
+        order = ""
+        if cursor is not None:
+            condition, order, after = keyset(["id"], "asc", decode_cursor(cursor, "id", "asc"))
+            if condition:
+                where = f"{where} AND {condition}" if where else f"WHERE {condition}"
+                values.update(after)
+            values["limit"] = limit + 1
+            values["offset"] = 0
+
         # Constructing and executing the query
         query = f"""
         SELECT * FROM carts {where}
+        {order}
         LIMIT %(limit)s OFFSET %(offset)s
         """
         cur.execute(query, values)
@@ -55,7 +72,7 @@ def get_all_carts(page: int, limit: int, max_date: int, min_date: int):
         list_data = []
         data = cur.fetchall()
         
-        if not data and page >= cur.rowcount:
+        if cursor is None and not data and page >= cur.rowcount:
             return {"data": []}
         if data is not None:
             for item in data:
@@ -67,6 +84,8 @@ def get_all_carts(page: int, limit: int, max_date: int, min_date: int):
                 }
                 list_data.append(new_data)
 
+            if cursor is not None:
+                return keyset_page(list_data, limit, "id", "asc", ["id"])
             return list_data
         else:
             return None
@@ -77,7 +96,8 @@ def get_all_carts(page: int, limit: int, max_date: int, min_date: int):
         cur.close()
 
 
-def get_carts_by_user_id(user_id: int, page: int, limit: int, max_date: int, min_date: int):
+@read_query
+def get_carts_by_user_id(user_id: int, page: int, limit: int, max_date: int, min_date: int, cursor: str = None):
     """
     Retrieve carts for a specific user based on pagination and optional date range filters.
 
@@ -87,15 +107,19 @@ def get_carts_by_user_id(user_id: int, page: int, limit: int, max_date: int, min
         limit (int): The maximum number of carts per page.
         max_date (int): The maximum date (timestamp) for filtering carts.
         min_date (int): The minimum date (timestamp) for filtering carts.
+        cursor (str, optional): Keyset pagination cursor. When not None, `page` is ignored and
+            carts are fetched after the ID encoded in the cursor ('' starts at the first one).
 
     Returns:
         list or None: A list of dictionaries containing cart information if carts are found, otherwise None.
+        In cursor mode a dictionary {"data": list, "next_cursor": str or None} is returned instead.
         Each dictionary contains the following keys:
         - "id" (int): Cart ID.
         - "user_id" (int): User ID associated with the cart.
         - "product_id" (int): Product ID in the cart.
         - "quantity" (int): Quantity of the product in the cart.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         page = int(page)
@@ -123,9 +147,20 @@ def get_carts_by_user_id(user_id: int, page: int, limit: int, max_date: int, min
         if where:
             where = "WHERE " + " AND ".join(where)
 
+        # Keyset pagination: seek past the last cart ID of the previous page instead of using OFFSET
+        order = ""
+        if cursor is not None:
+            condition, order, after = keyset(["id"], "asc", decode_cursor(cursor, "id", "asc"))
+            if condition:
+                where = f"{where} AND {condition}" if where else f"WHERE {condition}"
+                values.update(after)
+            values["limit"] = limit + 1
+            values["offset"] = 0
+
         # Constructing and executing the query
         query = f"""
         SELECT * FROM carts {where}
+        {order}
         LIMIT %(limit)s OFFSET %(offset)s
         """
         cur.execute(query, values)
@@ -133,7 +168,7 @@ def get_carts_by_user_id(user_id: int, page: int, limit: int, max_date: int, min
         # Fetching and formatting the result
         list_data = []
         data = cur.fetchall()
-        if not data and page >= cur.rowcount:
+        if cursor is None and not data and page >= cur.rowcount:
             return {"data": []}
         if data is not None:
             for item in data:
@@ -144,6 +179,8 @@ def get_carts_by_user_id(user_id: int, page: int, limit: int, max_date: int, min
                     "quantity": item[3],
                 }
                 list_data.append(new_data)
+            if cursor is not None:
+                return keyset_page(list_data, limit, "id", "asc", ["id"])
             return list_data
         else:
             return None
@@ -155,52 +192,79 @@ def get_carts_by_user_id(user_id: int, page: int, limit: int, max_date: int, min
 
 
 
-def get_cart_by_cart_id_and_user_id(cart_id: int, user_id: int):
+@read_query
+def get_cart_details_by_user_id(user_id: int):
     """
-    Retrieve a cart by its ID and associated user ID.
+    Retrieve the user's whole cart together with its products and totals.
+
+    Product data, the first image of every product, line subtotals and the
+    grand total all come from one joined query.
 
     Parameters:
-        cart_id (int): The ID of the cart to retrieve.
-        user_id (int): The ID of the user associated with the cart.
+        user_id (int): The ID of the user whose cart is to be retrieved.
 
     Returns:
-        dict or None: A dictionary containing cart information if the cart is found, otherwise None.
-        The dictionary contains the following keys:
-        - "id" (int): Cart ID.
-        - "user_id" (int): User ID associated with the cart.
-        - "product_id" (int): Product ID in the cart.
-        - "quantity" (int): Quantity of the product in the cart.
+        dict or None: None if the cart is empty, otherwise a dictionary with the following keys:
+        - "data" (list): One dictionary per cart line with "id", "product_id", "name", "price",
+          "stock", "image" (None if the product has no image), "quantity", "sub_total" and
+          "in_stock" (whether the stock covers the quantity).
+        - "total_quantity" (int): Sum of the quantities of every line.
+        - "grand_total" (int): Sum of the subtotals of every line.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute(
-            "SELECT id, user_id, product_id, quantity FROM carts WHERE id = %s AND user_id = %s", (cart_id, user_id)
+            """
+            SELECT c.id, c.product_id, p.name, p.price, p.quantity, img.image, c.quantity,
+                   p.price * c.quantity AS sub_total,
+                   sum(c.quantity) OVER () AS total_quantity,
+                   sum(p.price * c.quantity) OVER () AS grand_total
+            FROM carts c
+            JOIN products p ON p.id = c.product_id
+            LEFT JOIN LATERAL (
+                SELECT i.image FROM product_images i
+                WHERE i.product_id = c.product_id
+                ORDER BY i.id
+                LIMIT 1
+            ) img ON true
+            WHERE c.user_id = %s
+            ORDER BY c.id
+        """,
+            (user_id,),
         )
-        data = cur.fetchone()
-        if data is not None:
-            new_data = {
-                "id": data[0],
-                "user_id": data[1],
-                "product_id": data[2],
-                "quantity": data[3],
-            }
-            return new_data
-        else:
+        data = cur.fetchall()
+        if not data:
             return None
-
+        list_data = []
+        for item in data:
+            list_data.append({
+                "id": item[0],
+                "product_id": item[1],
+                "name": item[2],
+                "price": item[3],
+                "stock": item[4],
+                "image": item[5],
+                "quantity": item[6],
+                "sub_total": item[7],
+                "in_stock": item[4] >= item[6],
+            })
+        return {"data": list_data, "total_quantity": data[0][8], "grand_total": data[0][9]}
     except Exception as e:
         conn.rollback()
         raise e
     finally:
         cur.close()
 
-def get_carts_by_user_id_and_product_id(user_id: int, product_id: int):
+
+@read_query
+def get_cart_by_cart_id_and_user_id(cart_id: int, user_id: int):
     """
-    Retrieve a cart by user ID and product ID.
+    Retrieve a cart by its ID and associated user ID.
 
     Parameters:
+        cart_id (int): The ID of the cart to retrieve.
         user_id (int): The ID of the user associated with the cart.
-        product_id (int): The ID of the product in the cart.
 
     Returns:
         dict or None: A dictionary containing cart information if the cart is found, otherwise None.
@@ -210,13 +274,12 @@ def get_carts_by_user_id_and_product_id(user_id: int, product_id: int):
         - "product_id" (int): Product ID in the cart.
         - "quantity" (int): Quantity of the product in the cart.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute(
-            "SELECT id, user_id, product_id, quantity FROM carts WHERE user_id = %s AND product_id = %s",
-            (user_id, product_id),
+            "SELECT id, user_id, product_id, quantity FROM carts WHERE id = %s AND user_id = %s", (cart_id, user_id)
         )
-        conn.commit()
         data = cur.fetchone()
         if data is not None:
             new_data = {
@@ -228,62 +291,116 @@ def get_carts_by_user_id_and_product_id(user_id: int, product_id: int):
             return new_data
         else:
             return None
+
     except Exception as e:
         conn.rollback()
         raise e
     finally:
         cur.close()
 
-def add_carts(user_id: int, product_id: int, quantity: int):
+@write_query
+def upsert_cart(user_id: int, product_id: int, quantity: int):
     """
-    Add a new item to the user's cart.
+    Put a product in the user's cart, or set its quantity if it is already there.
+
+    The stock check and the insert or update run as one statement, relying on
+    the unique (user_id, product_id) constraint. Nothing is written when the
+    product does not exist or has less than `quantity` in stock.
 
     Parameters:
-        user_id (int): The ID of the user adding the item to the cart.
-        product_id (int): The ID of the product being added to the cart.
-        quantity (int): The quantity of the product being added.
+        user_id (int): The ID of the user whose cart is changed.
+        product_id (int): The ID of the product.
+        quantity (int): The quantity of the product in the cart.
 
     Returns:
-        None
+        dict: A dictionary containing the following keys:
+        - "stock" (int or None): Quantity in stock, None if the product does not exist.
+        - "cart_id" (int or None): ID of the cart row, None if nothing was written.
+        - "inserted" (bool or None): True if the row was added, False if it was updated.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute(
-            "INSERT INTO carts (product_id, user_id, quantity) VALUES (%s, %s, %s)",
-            (product_id, user_id, quantity),
+            """
+            WITH product AS (
+                SELECT id, quantity FROM products WHERE id = %(product_id)s
+            ), upserted AS (
+                INSERT INTO carts (product_id, user_id, quantity)
+                SELECT id, %(user_id)s, %(quantity)s FROM product WHERE quantity >= %(quantity)s
+                ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = EXCLUDED.quantity
+                RETURNING id, xmax = 0 AS inserted
+            )
+            SELECT product.quantity, upserted.id, upserted.inserted
+            FROM (SELECT 1) AS one
+            LEFT JOIN product ON true
+            LEFT JOIN upserted ON true
+        """,
+            {"user_id": user_id, "product_id": product_id, "quantity": quantity},
         )
+        data = cur.fetchone()
         conn.commit()
+        return {"stock": data[0], "cart_id": data[1], "inserted": data[2]}
     except Exception as e:
         conn.rollback()
         raise e
     finally:
         cur.close()
 
-def update_cart(product_id: int, user_id: int, quantity: int):
+@write_query
+def upsert_carts(user_id: int, quantities: dict):
     """
-    Update the quantity of a product in the user's cart.
+    Put several products in the user's cart at once, like upsert_cart does for one.
+
+    Every product is checked and every cart row inserted or updated by a single
+    statement. Products that do not exist or lack stock are left out of the
+    cart and reported.
 
     Parameters:
-        product_id (int): The ID of the product in the cart to be updated.
-        user_id (int): The ID of the user whose cart is being updated.
-        quantity (int): The new quantity of the product in the cart.
+        user_id (int): The ID of the user whose cart is changed.
+        quantities (dict): A dictionary mapping product IDs to their quantity in the cart.
 
     Returns:
-        None
+        dict: A dictionary mapping each product ID to a dictionary with the following keys:
+        - "stock" (int or None): Quantity in stock, None if the product does not exist.
+        - "cart_id" (int or None): ID of the cart row, None if nothing was written.
+        - "inserted" (bool or None): True if the row was added, False if it was updated.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute(
-            "UPDATE carts SET quantity=%s WHERE user_id=%s AND product_id=%s",
-            (quantity, user_id, product_id),
+            """
+            WITH product AS (
+                SELECT v.product_id, v.quantity, p.quantity AS stock
+                FROM unnest(%(product_ids)s::integer[], %(quantities)s::integer[]) AS v(product_id, quantity)
+                LEFT JOIN products p ON p.id = v.product_id
+            ), upserted AS (
+                INSERT INTO carts (product_id, user_id, quantity)
+                SELECT product_id, %(user_id)s, quantity FROM product WHERE stock >= quantity
+                ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = EXCLUDED.quantity
+                RETURNING id, product_id, xmax = 0 AS inserted
+            )
+            SELECT product.product_id, product.stock, upserted.id, upserted.inserted
+            FROM product
+            LEFT JOIN upserted ON upserted.product_id = product.product_id
+        """,
+            {
+                "user_id": user_id,
+                "product_ids": list(quantities),
+                "quantities": list(quantities.values()),
+            },
         )
+        data = cur.fetchall()
         conn.commit()
+        return {row[0]: {"stock": row[1], "cart_id": row[2], "inserted": row[3]} for row in data}
     except Exception as e:
         conn.rollback()
         raise e
     finally:
         cur.close()
 
+@write_query
 def delete_cart_by_user_id(user_id: int):
     """
     Delete all carts associated with a specific user.
@@ -294,6 +411,7 @@ def delete_cart_by_user_id(user_id: int):
     Returns:
         None
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute("DELETE FROM carts WHERE user_id = %s", (user_id,))
@@ -306,6 +424,7 @@ def delete_cart_by_user_id(user_id: int):
 
 
 
+@write_query
 def delete_cart_by_user_id_and_cart_id(cart_id: int, user_id: int):
     """
     Delete a specific cart associated with a user.
@@ -317,6 +436,7 @@ def delete_cart_by_user_id_and_cart_id(cart_id: int, user_id: int):
     Returns:
         None
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         
@@ -332,20 +452,75 @@ def delete_cart_by_user_id_and_cart_id(cart_id: int, user_id: int):
         cur.close()
 
 
+@read_query
+def get_carts_with_products(cart_ids: list, user_id: int):
+    """
+    Retrieve several carts of a user together with their products in one query.
+
+    Parameters:
+        cart_ids (list): The IDs of the carts to retrieve.
+        user_id (int): The ID of the user the carts must belong to.
+
+    Returns:
+        list: A list of dictionaries, one per cart found, ordered by cart ID.
+        Carts that do not exist or belong to another user are left out.
+        Each dictionary contains the following keys:
+        - "id" (int): Cart ID.
+        - "product_id" (int): Product ID in the cart.
+        - "quantity" (int): Quantity of the product in the cart.
+        - "price" (int): Current price of the product.
+        - "stock" (int): Current stock of the product.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            SELECT c.id, c.product_id, c.quantity, p.price, p.quantity
+            FROM carts c
+            JOIN products p ON p.id = c.product_id
+            WHERE c.id = ANY(%s) AND c.user_id = %s
+            ORDER BY c.id
+        """,
+            (list(cart_ids), user_id),
+        )
+        data = cur.fetchall()
+        list_data = []
+        for item in data:
+            new_data = {
+                "id": item[0],
+                "product_id": item[1],
+                "quantity": item[2],
+                "price": item[3],
+                "stock": item[4],
+            }
+            list_data.append(new_data)
+        return list_data
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        cur.close()
+
 
-def delete_cart_by_id(id: int):
+@write_query
+def delete_carts_by_ids(cart_ids: list, user_id: int):
     """
-    Delete a cart by its ID.
+    Delete several carts of a user in one statement.
+
+    The caller commits the surrounding transaction.
 
     Parameters:
-        id (int): The ID of the cart to be deleted.
+        cart_ids (list): The IDs of the carts to be deleted.
+        user_id (int): The ID of the user the carts belong to.
 
     Returns:
         None
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
-        cur.execute("DELETE FROM carts WHERE id = %s", (id,))
+        cur.execute("DELETE FROM carts WHERE id = ANY(%s) AND user_id = %s", (list(cart_ids), user_id))
     except Exception as e:
         raise e
     finally:
@@ -0,0 +1,101 @@
+from db import get_conn, read_query, write_query
+from psycopg2 import extensions
+import os, threading, time
+
+# Seconds a worker trusts the catalog version it last read. Catalog writes made
+# by other workers show up (in ETags and in cached catalog reads) after at most
+# this long.
+CATALOG_VERSION_TTL = float(os.getenv("CATALOG_VERSION_TTL", 1))
+
+# This worker's latest view of the catalog_version row
+_seen = None
+_seen_at = None
+_seen_lock = threading.Lock()
+
+
+@read_query
+def get_catalog_version():
+    """
+    Retrieve the current version of the catalog.
+
+    May run inside a caller's open transaction, which it then leaves open.
+
+    Returns:
+        tuple: (version, updated_at) where version (int) changes on every catalog write
+        and updated_at (datetime) is the time of the latest one.
+    """
+    conn = get_conn()
+    idle = conn.info.transaction_status == extensions.TRANSACTION_STATUS_IDLE
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT version, updated_at FROM catalog_version")
+        row = cur.fetchone()
+        if idle:
+            conn.commit()
+        return row
+    except Exception as e:
+        if idle:
+            conn.rollback()
+        raise e
+    finally:
+        cur.close()
+
+
+def current_catalog_version():
+    """
+    Return the catalog version as seen by this worker.
+
+    The catalog_version row is read again at most every CATALOG_VERSION_TTL
+    seconds, so catalog GETs answered from the in-process caches do not need a
+    query of their own. ETags and cache entries are both tagged with this
+    value, so a response is never labelled with a newer version than the data
+    it was built from.
+
+    Returns:
+        tuple: (version, updated_at), see get_catalog_version().
+    """
+    global _seen, _seen_at
+    if _seen is None or time.monotonic() - _seen_at >= CATALOG_VERSION_TTL:
+        with _seen_lock:
+            if _seen is None or time.monotonic() - _seen_at >= CATALOG_VERSION_TTL:
+                _seen = get_catalog_version()
+                _seen_at = time.monotonic()
+    return _seen
+
+
+def current_catalog_version_number():
+    """
+    Return only the version number of current_catalog_version(), for tagging cache entries.
+    """
+    return current_catalog_version()[0]
+
+
+@write_query
+def bump_catalog_version():
+    """
+    Mark the catalog as changed.
+
+    Must be called after the catalog write has been committed: a reader that
+    sees the new version is then guaranteed to also see the new data. The bump
+    is committed on its own and becomes this worker's current version at once.
+
+    Every change of what the catalog shows bumps it, stock changes from
+    checkouts included, since listings and category stats show the stock.
+
+    Returns:
+        None
+    """
+    global _seen, _seen_at
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("UPDATE catalog_version SET version = version + 1, updated_at = now() RETURNING version, updated_at")
+        row = cur.fetchone()
+        conn.commit()
+        with _seen_lock:
+            _seen, _seen_at = row, time.monotonic()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        cur.close()
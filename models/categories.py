@@ -1,9 +1,199 @@
-from db import conn
+from db import get_conn, read_query, write_query
+import os, threading, time
+from models.catalog import CATALOG_VERSION_TTL, bump_catalog_version, current_catalog_version_number
+from models.products import invalidate_product_cache, category_stats_cache
+from cache import cached
 
-def get_categories():
+# CATEGORY REGISTRY
+
+CATEGORY_REGISTRY_TTL = float(os.getenv("CATEGORY_REGISTRY_TTL", 60))
+
+
+class CategoryRegistry:
+    """
+    Process-wide copy of the categories table with lookups by ID, name and slug.
+
+    The table is loaded on first use in each worker process and reloaded after
+    any category write made by this process (see invalidate()), or when the
+    catalog version changes, which is how writes made by other workers show up.
+    It is also reloaded after `ttl` seconds regardless, and before a lookup
+    reports a miss if the table is older than CATALOG_VERSION_TTL, so a
+    category just added by another worker is found even before this worker
+    has seen the new catalog version. Misses on a fresh table (e.g. unknown
+    categories sent by clients) do not query the database.
+
+    Args:
+        ttl (float): Seconds before the registry reloads the table on its own.
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        # Catalog version the loaded table belongs to
+        self._catalog_version = None
+        # Bumped by invalidate() so a reload racing with a write is not kept as fresh
+        self._version = 0
+        self._by_id = {}
+        self._by_name = {}
+        self._by_slug = {}
+
+    def _stale(self):
+        return (
+            self._loaded_at is None
+            or time.monotonic() - self._loaded_at >= self.ttl
+            or self._catalog_version != current_catalog_version_number()
+        )
+
+    def _maps(self):
+        if self._stale():
+            with self._lock:
+                if self._stale():
+                    self.refresh()
+        return self._by_id, self._by_name, self._by_slug
+
+    def _outdated_for_miss(self):
+        loaded_at = self._loaded_at
+        return loaded_at is None or time.monotonic() - loaded_at >= CATALOG_VERSION_TTL
+
+    def _lookup(self, find):
+        # find(by_id, by_name, by_slug) returns the category or None; on a
+        # miss an older table is reloaded once in case the category is new
+        category = find(*self._maps())
+        if category is None and self._outdated_for_miss():
+            with self._lock:
+                if self._outdated_for_miss():
+                    self.refresh()
+            category = find(*self._maps())
+        return dict(category) if category else None
+
+    def refresh(self):
+        """
+        Reload the categories table.
+        """
+        version = self._version
+        catalog_version = current_catalog_version_number()
+        by_id, by_name, by_slug = {}, {}, {}
+        for row in _load_categories():
+            category = {"category_id": row[0], "name": row[1], "slug": row[2]}
+            by_id[category["category_id"]] = category
+            by_name[category["name"]] = category
+            if category["slug"]:
+                by_slug[category["slug"].lower()] = category
+        self._by_id, self._by_name, self._by_slug = by_id, by_name, by_slug
+        self._catalog_version = catalog_version
+        self._loaded_at = time.monotonic() if version == self._version else None
+
+    def invalidate(self):
+        """
+        Mark the registry stale so the next lookup reloads it.
+        """
+        self._version += 1
+        self._loaded_at = None
+
+    def all(self):
+        """
+        Return every category ordered by ID.
+        """
+        by_id = self._maps()[0]
+        return [dict(by_id[id]) for id in sorted(by_id)]
+
+    def get(self, id: int):
+        """
+        Return the category with the given ID, or None.
+        """
+        try:
+            id = int(id)
+        except (TypeError, ValueError):
+            return None
+        return self._lookup(lambda by_id, by_name, by_slug: by_id.get(id))
+
+    def find_name(self, name: str):
+        """
+        Return the category whose name is exactly `name`, or None.
+        """
+        return self._lookup(lambda by_id, by_name, by_slug: by_name.get(name))
+
+    def resolve(self, value: str):
+        """
+        Resolve a category filter given by users to a category.
+
+        Tries the exact name first, then the name ignoring case, then the slug.
+        """
+        if not value:
+            return None
+        def find(by_id, by_name, by_slug):
+            category = by_name.get(value)
+            if category is None:
+                category = next((c for c in by_id.values() if c["name"].lower() == value.lower()), None)
+            if category is None:
+                category = by_slug.get(value.lower())
+            return category
+
+        return self._lookup(find)
+
+
+@read_query
+def _load_categories():
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT id, name, slug FROM categories ORDER BY id")
+        return cur.fetchall()
+    finally:
+        cur.close()
+
+
+category_registry = CategoryRegistry(CATEGORY_REGISTRY_TTL)
+
+
+def _public(category):
+    if category is None:
+        return None
+    return {"category_id": category["category_id"], "name": category["name"]}
+
+
+@cached(category_stats_cache, key=lambda: "all")
+@read_query
+def get_category_stats():
+    """
+    Compute product statistics for every category with one grouped query.
+
+    Cached until the next product or category write of this process, like the
+    product listings.
+
+    Returns:
+    - dict: A dictionary mapping category IDs to dictionaries with the following keys:
+        - "product_count" (int): Number of products in the category.
+        - "in_stock_count" (int): Number of those products with stock left.
+        - "min_price" (int or None): Lowest product price, None without products.
+        - "max_price" (int or None): Highest product price, None without products.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            SELECT c.id, count(p.id), count(p.id) FILTER (WHERE p.quantity > 0), min(p.price), max(p.price)
+            FROM categories c
+            LEFT JOIN products p ON p.category_id = c.id
+            GROUP BY c.id
+        """
+        )
+        return {
+            row[0]: {"product_count": row[1], "in_stock_count": row[2], "min_price": row[3], "max_price": row[4]}
+            for row in cur.fetchall()
+        }
+    finally:
+        cur.close()
+
+
+def get_categories(with_stats: bool = False):
     """
     Retrieve all categories.
 
+    Parameters:
+    - with_stats (bool, optional): Add the product statistics of get_category_stats() to every category.
+
     Returns:
     - list: A list containing dictionaries with category information including category ID and name.
         data = {
@@ -11,22 +201,16 @@ def get_categories():
                 "name":data[1],
             }
     """
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT id category_id,name,slug FROM categories order by id")
-        categories = cur.fetchall()
-        list_categories = []
+    categories = [_public(category) for category in category_registry.all()]
+    if with_stats:
+        stats = get_category_stats()
         for category in categories:
-            item = {
-                "category_id":category[0],
-                "name":category[1],
-            }
-            list_categories.append(item)
-        return list_categories
-    except Exception as e:
-        raise e
-    finally:
-        cur.close()
+            # A category created by another worker may be missing from cached stats
+            category.update(stats.get(
+                category["category_id"],
+                {"product_count": 0, "in_stock_count": 0, "min_price": None, "max_price": None},
+            ))
+    return categories
 
 def get_category(id: int):
     """
@@ -38,20 +222,7 @@ def get_category(id: int):
     Returns:
     - dict or None: A dictionary containing category information including category ID and name if the category is found, or None if the category ID is not found.
     """
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT id AS category_id,name,slug FROM categories where id = %s ORDER BY category_id ASC",(id,))
-        category = cur.fetchone()
-        if category:
-            item = {
-                "category_id":category[0],
-                "name":category[1],
-            }
-            return item           
-    except Exception as e:
-        raise e
-    finally:
-        cur.close()
+    return _public(category_registry.get(id))
 
 def get_category_name(name: str):
     """
@@ -67,22 +238,21 @@ def get_category_name(name: str):
                 "name":data[1],
             }
     """
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT id AS category_id,name,slug FROM categories where name = %s",(name,))
-        category = cur.fetchone()
+    return _public(category_registry.find_name(name))
 
-        if category:
-            item = {
-                "category_id":category[0],
-                "name":category[1],
-            }
-            return item           
-    except Exception as e:
-        raise e
-    finally:
-        cur.close()
+def resolve_category(value: str):
+    """
+    Resolve a category filter (name in any case, or slug) to a category.
+
+    Parameters:
+    - value (str): The category name or slug supplied by the client.
+
+    Returns:
+    - dict or None: A dictionary containing category ID and name, or None if no category matches.
+    """
+    return _public(category_registry.resolve(value))
 
+@write_query
 def add_category(name: str):
     """
     Add a new category to the database.
@@ -93,16 +263,21 @@ def add_category(name: str):
     Returns:
     - None
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute("INSERT INTO categories (name,slug) VALUES (%s,%s)",(name,name))
-        conn.commit()          
+        conn.commit()
+        category_registry.invalidate()
+        category_stats_cache.clear()
+        bump_catalog_version()
     except Exception as e:
         conn.rollback()
         raise e
     finally:
         cur.close()
 
+@write_query
 def update_category(id: int,name: str):
     """
     Update category information in the database.
@@ -114,16 +289,21 @@ def update_category(id: int,name: str):
     Returns:
     - None
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute("UPDATE categories SET name = %s, slug = %s where id = %s",(name,name,id))
-        conn.commit()          
+        conn.commit()
+        category_registry.invalidate()
+        # Products embed their category, see models.products.include_columns
+        invalidate_product_cache()
     except Exception as e:
         conn.rollback()
         raise e
     finally:
         cur.close()
 
+@write_query
 def delete_category(id: int):
     """
     Delete a category from the database.
@@ -134,10 +314,14 @@ def delete_category(id: int):
     Returns:
     - None
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute("DELETE from categories where id = %s",(id,))
-        conn.commit()         
+        conn.commit()
+        category_registry.invalidate()
+        # Products embed their category, see models.products.include_columns
+        invalidate_product_cache()
     except Exception as e:
         conn.rollback()
         raise e
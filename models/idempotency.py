@@ -0,0 +1,155 @@
+import os
+from psycopg2.extras import Json
+from db import get_conn, write_query
+
+# Hours an idempotency key is remembered; an older key may be used again.
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", 24))
+
+
+@write_query
+def claim_idempotency_key(user_id: int, key: str, endpoint: str, fingerprint: str):
+    """
+    Reserve an idempotency key for the request being handled.
+
+    The key is inserted without committing: it is committed together with the
+    checkout that follows, and disappears if that checkout is rolled back. A
+    concurrent request with the same key waits here until the first one ends.
+
+    Parameters:
+        user_id (int): The ID of the user sending the request.
+        key (str): The value of the Idempotency-Key header.
+        endpoint (str): The path of the request.
+        fingerprint (str): Hash of the request, see idempotency.request_fingerprint.
+
+    Returns:
+        dict or None: None if the key was reserved for this request, otherwise the
+        earlier request's row with "endpoint", "fingerprint", "status_code" and
+        "response" (the last two are None while it has not stored its response).
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            DELETE FROM idempotency_keys
+            WHERE user_id = %s AND key = %s AND created_at < now() - %s * INTERVAL '1 hour'
+        """,
+            (user_id, key, IDEMPOTENCY_KEY_TTL),
+        )
+        cur.execute(
+            """
+            INSERT INTO idempotency_keys (user_id, key, endpoint, fingerprint)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (user_id, key) DO NOTHING
+            RETURNING user_id
+        """,
+            (user_id, key, endpoint, fingerprint),
+        )
+        if cur.fetchone() is not None:
+            return None
+        cur.execute(
+            """
+            SELECT endpoint, fingerprint, status_code, response
+            FROM idempotency_keys
+            WHERE user_id = %s AND key = %s
+        """,
+            (user_id, key),
+        )
+        row = cur.fetchone()
+        conn.commit()
+        return {"endpoint": row[0], "fingerprint": row[1], "status_code": row[2], "response": row[3]}
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        cur.close()
+
+
+@write_query
+def save_idempotent_response(user_id: int, key: str, status_code: int, response):
+    """
+    Store the response of a request so that replays can return it.
+
+    Nothing is committed here: the caller stores the response in the same
+    transaction as the checkout it describes, so that the key is never
+    committed without a response.
+
+    Parameters:
+        user_id (int): The ID of the user who sent the request.
+        key (str): The value of the Idempotency-Key header.
+        status_code (int): The HTTP status code of the response.
+        response: The JSON body of the response.
+
+    Returns:
+        None
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            UPDATE idempotency_keys
+            SET status_code = %s, response = %s
+            WHERE user_id = %s AND key = %s
+        """,
+            (status_code, Json(response), user_id, key),
+        )
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        cur.close()
+
+
+@write_query
+def release_idempotency_key(user_id: int, key: str):
+    """
+    Forget a key whose request failed, so the client can retry it.
+
+    Only a key without a stored response is removed.
+
+    Parameters:
+        user_id (int): The ID of the user who sent the request.
+        key (str): The value of the Idempotency-Key header.
+
+    Returns:
+        None
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "DELETE FROM idempotency_keys WHERE user_id = %s AND key = %s AND response IS NULL",
+            (user_id, key),
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        cur.close()
+
+
+@write_query
+def purge_idempotency_keys():
+    """
+    Delete the idempotency keys older than IDEMPOTENCY_KEY_TTL hours.
+
+    Returns:
+        int: The number of keys deleted.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "DELETE FROM idempotency_keys WHERE created_at < now() - %s * INTERVAL '1 hour'",
+            (IDEMPOTENCY_KEY_TTL,),
+        )
+        deleted = cur.rowcount
+        conn.commit()
+        return deleted
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        cur.close()
@@ -1,8 +1,183 @@
-from db import conn
-from datetime import datetime
+from db import get_conn, read_query, write_query
+from pagination import decode_cursor, keyset, keyset_page
+from cache import LRUCache, cached
+from models.catalog import bump_catalog_version, current_catalog_version_number
+import re, os, io, csv
+from psycopg2.extras import execute_values
+
+# Text search configurations the products.search_vector column is built with
+SEARCH_LANGUAGES = ["simple", "indonesian"]
+
+# Storefront reads are served from these caches. Entries are tagged with the
+# catalog version, so a catalog write made by any worker, checkouts included
+# (see invalidate_product_cache()), turns them into misses everywhere.
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", 30))
+product_cache = LRUCache(
+    "products", int(os.getenv("PRODUCT_CACHE_SIZE", 1000)), PRODUCT_CACHE_TTL, current_catalog_version_number
+)
+product_list_cache = LRUCache(
+    "product_lists", int(os.getenv("PRODUCT_LIST_CACHE_SIZE", 256)), PRODUCT_CACHE_TTL, current_catalog_version_number
+)
+# Per-category product statistics, see models.categories.get_category_stats()
+category_stats_cache = LRUCache("category_stats", 1, PRODUCT_CACHE_TTL, current_catalog_version_number)
+
+
+# Rows sent to the staging table per COPY by import_products()
+IMPORT_BATCH_SIZE = int(os.getenv("PRODUCT_IMPORT_BATCH_SIZE", 5000))
+
+# Columns of every product read, in the order _product_row() expects
+PRODUCT_COLUMNS = [
+    "p.id", "p.name", "p.description", "p.price", "p.quantity", "p.created_at", "p.category_id",
+    "p.version", "p.updated_at",
+]
+
+# Related data that product reads can embed, see include_columns()
+PRODUCT_INCLUDES = ["images", "category"]
+
+
+def _product_key(id):
+    # IDs arrive both as ints (URL converters) and as strings (form fields)
+    try:
+        return int(id)
+    except (TypeError, ValueError):
+        return id
+
+
+def _product_row(row, extra=()):
+    # Build a product dictionary from a row selected with PRODUCT_COLUMNS,
+    # followed by the columns named in extra
+    product = {
+        "id": row[0],
+        "name": row[1],
+        "description": row[2],
+        "price": row[3],
+        "quantity": row[4],
+        "created_at": row[5],
+        "category_id": row[6],
+        "version": row[7],
+        "updated_at": row[8],
+    }
+    for i, name in enumerate(extra):
+        product[name] = row[len(PRODUCT_COLUMNS) + i]
+    return product
+
+
+def _include_key(include):
+    return tuple(sorted(set(include or ())))
+
+
+def _product_cache_keys(product_id):
+    # One cached entry per combination of includes
+    includes = [()]
+    for name in sorted(PRODUCT_INCLUDES):
+        includes += [include + (name,) for include in includes]
+    return [(_product_key(product_id), include) for include in includes]
+
+
+def include_columns(include):
+    """
+    Build the SQL pieces embedding related data into a product query aliased `p`.
+
+    Parameters:
+        include (list): Names from PRODUCT_INCLUDES.
+
+    Returns:
+        tuple: (names, columns, joins) where names are the keys the extra columns
+        are returned under, columns their SELECT expressions and joins the JOIN
+        clauses they need.
+    """
+    names, columns, joins = [], [], []
+    if "images" in include:
+        # Every image of the product as a JSON array, aggregated in the same query
+        names.append("images")
+        columns.append("""(
+            SELECT coalesce(json_agg(json_build_object('id', i.id, 'image', i.image) ORDER BY i.id), '[]'::json)
+            FROM product_images i
+            WHERE i.product_id = p.id
+        ) AS images""")
+    if "category" in include:
+        names.append("category")
+        columns.append(
+            "CASE WHEN c.id IS NULL THEN NULL ELSE json_build_object('id', c.id, 'name', c.name, 'slug', c.slug) END AS category"
+        )
+        joins.append("LEFT JOIN categories c ON c.id = p.category_id")
+    return names, columns, joins
+
+
+def _product_list_key(page, limit, category_id, keyword, min_price, max_price, order_by, sort, cursor, search_mode, search_lang, include):
+    """
+    Normalize get_all_products arguments so equivalent requests share a cache entry.
+    """
+    def text(value, lower=False):
+        if value is None or str(value).strip() == "":
+            return None
+        value = str(value).strip()
+        return value.lower() if lower else value
+
+    return (
+        # The page number is ignored in cursor mode
+        None if cursor is not None else _product_key(page),
+        _product_key(limit),
+        _product_key(category_id),
+        text(keyword, lower=True),
+        text(min_price),
+        text(max_price),
+        text(order_by),
+        text(sort),
+        cursor,
+        text(search_mode),
+        text(search_lang),
+        _include_key(include),
+    )
+
+
+def _clear_product_caches(product_ids):
+    product_list_cache.clear()
+    category_stats_cache.clear()
+    if not product_ids:
+        product_cache.clear()
+    for product_id in product_ids:
+        for key in _product_cache_keys(product_id):
+            product_cache.invalidate(key)
+
+
+def invalidate_product_cache(*product_ids):
+    """
+    Drop cached product listings together with the given cached products, and
+    bump the catalog version used for conditional GETs.
+
+    Must be called after the product write has been committed.
+
+    Parameters:
+    - *product_ids (int): IDs of the products that changed. Without any ID every cached product is dropped.
+
+    Returns:
+    - None
+    """
+    _clear_product_caches(product_ids)
+    bump_catalog_version()
+
 
+def prefix_tsquery(keyword: str):
+    """
+    Turn a free-text keyword into a tsquery string matching every word as a prefix.
+
+    Parameters:
+        keyword (str): The keyword typed by the user.
+
+    Returns:
+        str: A tsquery such as "kopi:* & arab:*". Characters with a meaning in the
+        tsquery syntax are dropped, so the result is always valid.
+    """
+    words = re.findall(r"\w+", keyword)
+    return " & ".join(word + ":*" for word in words)
+
+
+@cached(product_list_cache, key=_product_list_key)
+@read_query
 def get_all_products(
-    page: int, limit: int, category: str, keyword: str, min_price: int, max_price: int, order_by: str, sort: str = 'asc'
+    page: int, limit: int, category_id: int, keyword: str, min_price: int, max_price: int, order_by: str, sort: str = 'asc',
+    cursor: str = None, search_mode: str = None, search_lang: str = None, include: list = None,
 ):
     """
     Retrieve a list of products based on provided filters.
@@ -10,15 +185,22 @@ def get_all_products(
     Parameters:
         page (int): The page number for pagination.
         limit (int): The maximum number of products per page.
-        category (str): The category of the products.
+        category_id (int): The ID of the category of the products.
         keyword (str): The keyword to search for in product names.
         min_price (int): The minimum price of products to include.
         max_price (int): The maximum price of products to include.
-        order_by (str): The field to order the products by.
+        order_by (str): The field to order the products by. 'relevance' is available in full-text mode.
         sort (str, optional): The sorting order ('asc' or 'desc'). Defaults to 'asc'.
+        cursor (str, optional): Keyset pagination cursor. When not None, `page` is ignored and
+            rows are fetched after the position encoded in the cursor ('' starts at the first row).
+        search_mode (str, optional): 'contains' (default) matches the keyword anywhere in the name,
+            'fts' runs a full-text prefix search over name and description.
+        search_lang (str, optional): Text search dictionary for 'fts' mode, 'simple' (default) or 'indonesian'.
+        include (list, optional): Related data to embed, any of PRODUCT_INCLUDES.
 
     Returns:
         list: A list of dictionaries containing product information.
+        In cursor mode a dictionary {"data": list, "next_cursor": str or None} is returned instead.
         Each dictionary contains the following keys:
         - "id" (int): Product ID.
         - "name" (str): Product name.
@@ -26,26 +208,56 @@ def get_all_products(
         - "price" (float): Product price.
         - "quantity" (int): Product quantity.
         - "created_at" (str): Product creation timestamp.
-        - "category" (str, optional): Product category name (present only if category is specified).
         - "category_id" (int): Product category ID.
+        - "version" (int): Row version, increased by every update of the product.
+        - "updated_at" (str): Timestamp of the latest update.
+        - "relevance" (float, optional): Full-text rank (present only in 'fts' mode).
+        - "images" (list, optional): Dictionaries with "id" and "image" (present only with include images).
+        - "category" (dict or None, optional): "id", "name" and "slug" of the category (present only with include category).
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         page = int(page)
         page = (page - 1) * limit
         values = {"limit": limit, "offset": page}
-        join = []
+        columns = list(PRODUCT_COLUMNS)
         where = []
-        
-        if keyword:
+        whitelist_orders = [
+            "id", "name", "price", "category_id"
+        ]
+        # Expressions used for ordering columns that are not plain product columns
+        order_columns = {}
+        # Keys of the columns selected after the product columns
+        extra = []
+
+        whitelist_search_modes = ["contains", "fts"]
+        if search_mode and search_mode not in whitelist_search_modes:
+            raise ValueError("Value search_mode tidak ada didalam whitelist, whitelist yang tersedia: " + ", ".join(whitelist_search_modes))
+        fulltext = bool(keyword) and search_mode == "fts"
+        if fulltext:
+            # Full-text search on the maintained search_vector column, every word matched as a prefix
+            search_lang = search_lang or "simple"
+            if search_lang not in SEARCH_LANGUAGES:
+                raise ValueError("Value search_lang tidak ada didalam whitelist, whitelist yang tersedia: " + ", ".join(SEARCH_LANGUAGES))
+            # ts_rank() returns real; as float8 the rank survives the round trip
+            # through a cursor exactly, so keyset comparisons hit the same row
+            rank = "ts_rank(p.search_vector, to_tsquery(%(ts_config)s, %(tsquery)s))::float8"
+            where.append("p.search_vector @@ to_tsquery(%(ts_config)s, %(tsquery)s)")
+            values["ts_config"] = search_lang
+            values["tsquery"] = prefix_tsquery(keyword)
+            columns.append(f"{rank} AS relevance")
+            extra.append("relevance")
+            whitelist_orders.append("relevance")
+            order_columns["relevance"] = rank
+        elif keyword:
             # Add filter for product name based on keyword
             where.append("p.name ilike %(keyword)s")
             values["keyword"] = "%" + keyword + "%"
-        if category:
-            # Add filter for category name based on category
-            where.append("categories.name ilike %(category)s")
-            join.append("JOIN categories on p.category_id = categories.id")
-            values["category"] = "%" + category + "%"
+        if category_id:
+            # Add filter for the category, resolved to its ID by the caller
+            where.append("p.category_id = %(category_id)s")
+            values["category_id"] = category_id
         if max_price and min_price:
             # Add filter for price range between min_price and max_price
             where.append("price BETWEEN %(min_price)s AND %(max_price)s")
@@ -60,9 +272,6 @@ def get_all_products(
             where.append("price <= %(max_price)s")
             values["max_price"] = max_price
         
-        whitelist_orders = [
-            "id", "name", "price", "category_id"
-        ]
         # Check if the provided order_by field is valid
         if order_by:
             if order_by not in whitelist_orders:
@@ -82,11 +291,34 @@ def get_all_products(
             where = "WHERE " + " AND ".join(where)
         else:
             where = ""
+        # Embed the requested related data in the same query
+        include_names, include_selects, joins = include_columns(include or [])
+        extra += include_names
+        columns += include_selects
 
         # Check if both order_by and sort are provided together
         if not order_by and sort:
             raise ValueError("harus menginputkan juga order_by, wihtelist yang tersedia: " + ", ".join(whitelist_orders))
-        if order_by:
+        # The most relevant products come first unless asked otherwise
+        if order_by == "relevance" and not sort:
+            sort = "desc"
+        if cursor is not None:
+            # Keyset pagination: seek past the last row of the previous page on
+            # (order_by, id) instead of skipping rows with OFFSET
+            key_fields = [order_by, "id"] if order_by and order_by != "id" else ["id"]
+            condition, order, after = keyset(
+                [order_columns.get(field, f"p.{field}") for field in key_fields],
+                sort,
+                decode_cursor(cursor, order_by, sort),
+            )
+            if condition:
+                where = f"{where} AND {condition}" if where else f"WHERE {condition}"
+                values.update(after)
+            values["limit"] = limit + 1
+            values["offset"] = 0
+            # The direction is already part of the keyset ORDER BY
+            sort_order, sort = sort, ''
+        elif order_by:
             order = f"ORDER BY {order_by}"
             # Ensure the sort parameter is included if provided
             if sort:
@@ -96,8 +328,8 @@ def get_all_products(
         else:
             order = ''
         query = f"""
-        SELECT * FROM products p 
-        {' '.join(join)} {where}
+        SELECT {', '.join(columns)} FROM products p {' '.join(joins)}
+        {where}
         {order} {sort}
         limit %(limit)s offset %(offset)s
         """
@@ -105,34 +337,14 @@ def get_all_products(
         conn.commit()
         products = cur.fetchall()
         # If no products are fetched and the page exceeds the total number of rows, return an empty data list 
-        if not products and page >= cur.rowcount:
+        if cursor is None and not products and page >= cur.rowcount:
             return {"data": []}
         list_products = []
         # Iterate through fetched products and prepare them for response
         for item in products:
-            if category is not None:
-                items = {
-                    "id": item[0],
-                    "name": item[1],
-                    "description": item[2],
-                    "price": item[3],
-                    "quantity": item[4],
-                    "created_at": item[5],
-                    "category": item[8],
-                    "category_id": item[6],
-                }
-                list_products.append(items)
-            else:
-                items = {
-                    "id": item[0],
-                    "name": item[1],
-                    "description": item[2],
-                    "price": item[3],
-                    "quantity": item[4],
-                    "created_at": item[5],
-                    "category_id": item[6],
-                }
-                list_products.append(items)
+            list_products.append(_product_row(item, extra))
+        if cursor is not None:
+            return keyset_page(list_products, limit, order_by, sort_order, key_fields)
         return list_products
     except ValueError as e:
         return {"message": str(e)}
@@ -144,16 +356,59 @@ def get_all_products(
 
 
 
-def get_products_by_category(category_id: int):
+def get_products_by_category(
+    category_id: int, page: int = 1, limit: int = 5, min_price: int = None, max_price: int = None,
+    order_by: str = None, sort: str = None, cursor: str = None, include: list = None,
+):
     """
-    Retrieve products based on the provided category ID.
+    Retrieve one page of the products of a category.
 
-    Parameter:
+    This is get_all_products restricted to the category, so it paginates,
+    sorts and filters the same way and shares its cache, which every product
+    write invalidates.
+
+    Parameters:
         category_id (int): The ID of the category to retrieve products for.
+        page (int, optional): The page number for pagination. Defaults to 1.
+        limit (int, optional): The maximum number of products per page. Defaults to 5.
+        min_price (int, optional): The minimum price of products to include.
+        max_price (int, optional): The maximum price of products to include.
+        order_by (str, optional): The field to order the products by.
+        sort (str, optional): The sorting order ('asc' or 'desc').
+        cursor (str, optional): Keyset pagination cursor, see get_all_products.
+        include (list, optional): Related data to embed, any of PRODUCT_INCLUDES.
 
     Returns:
-        list or None: A list of dictionaries containing product information if found, otherwise None.
-        Each dictionary contains the following keys:
+        list or dict: The result of get_all_products.
+    """
+    return get_all_products(
+        page=page,
+        limit=limit,
+        category_id=category_id,
+        keyword=None,
+        min_price=min_price,
+        max_price=max_price,
+        order_by=order_by,
+        sort=sort,
+        cursor=cursor,
+        include=include,
+    )
+
+
+@cached(product_cache, key=lambda id, include: (_product_key(id), _include_key(include)))
+@read_query
+def get_product_by_id(id: int, include: list = None):
+    """
+    Retrieve a product based on a specified product ID.
+
+    Parameters:
+    - id (int): The ID of the product to be retrieved.
+    - include (list, optional): Related data to embed, any of PRODUCT_INCLUDES.
+
+    Returns:
+    - dict or None: A dictionary representing the product with the specified ID.
+     - list: A list of dictionaries representing products.
+      The dictionary contains the following keys:
         - "id" (int): Product ID.
         - "name" (str): Product name.
         - "description" (str): Product description.
@@ -161,33 +416,28 @@ def get_products_by_category(category_id: int):
         - "quantity" (int): Product quantity.
         - "created_at" (str): Product creation timestamp.
         - "category_id" (int): Product category ID.
+        - "version" (int): Row version, increased by every update of the product.
+        - "updated_at" (str): Timestamp of the latest update.
+        - "images" (list, optional): Dictionaries with "id" and "image" (present only with include images).
+        - "category" (dict or None, optional): "id", "name" and "slug" of the category (present only with include category).
+    If no product is found with the specified ID, returns None.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
+        include_names, include_selects, joins = include_columns(include or [])
+        columns = list(PRODUCT_COLUMNS)
         cur.execute(
-            """
-            SELECT id, name, description, price, quantity, created_at, category_id
-            FROM products
-            where category_id=%(category_id)s
-            order by id asc 
+            f"""
+            SELECT {', '.join(columns + include_selects)}
+            FROM products p {' '.join(joins)}
+            where p.id = %s
         """,
-            {"category_id": category_id},
+            (id,),
         )
-        result_set = cur.fetchall()
-        if result_set:
-            products = []
-            for row in result_set:
-                new_products = {
-                    "id": row[0],
-                    "name": row[1],
-                    "description": row[2],
-                    "price": row[3],
-                    "quantity": row[4],
-                    "created_at": row[5],
-                    "category_id": row[6],
-                }
-                products.append(new_products)
-            return products
+        row = cur.fetchone()
+        if row is not None:
+            return _product_row(row, include_names)
         else:
             return None
     except Exception as e:
@@ -196,57 +446,48 @@ def get_products_by_category(category_id: int):
         cur.close()
 
 
-def get_product_by_id(id: int):
+@read_query
+def get_products_by_ids(ids: list, include: list = None):
     """
-    Retrieve a product based on a specified product ID.
+    Retrieve many products at once by their IDs.
 
     Parameters:
-    - id (int): The ID of the product to be retrieved.
+        ids (list): The IDs of the products to be retrieved. Duplicates are ignored.
+        include (list, optional): Related data to embed, any of PRODUCT_INCLUDES.
 
     Returns:
-    - dict or None: A dictionary representing the product with the specified ID.
-     - list: A list of dictionaries representing products.
-      The dictionary contains the following keys:
-        - "id" (int): Product ID.
-        - "name" (str): Product name.
-        - "description" (str): Product description.
-        - "price" (float): Product price.
-        - "quantity" (int): Product quantity.
-        - "created_at" (str): Product creation timestamp.
-        - "category_id" (int): Product category ID.
-    If no product is found with the specified ID, returns None.
+        dict: A dictionary containing the following keys:
+        - "data" (list): The products found, in the order of `ids`, with the keys
+          returned by get_product_by_id.
+        - "missing" (list): The IDs for which no product exists, in the order of `ids`.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
+        ids = list(dict.fromkeys(int(id) for id in ids))
+        include_names, include_selects, joins = include_columns(include or [])
+        columns = list(PRODUCT_COLUMNS)
         cur.execute(
-            """
-            SELECT id,name,description,price,quantity,created_at,category_id
-            FROM products
-            where id = %s      
-            order by id asc 
+            f"""
+            SELECT {', '.join(columns + include_selects)}
+            FROM products p {' '.join(joins)}
+            WHERE p.id = ANY(%(ids)s)
+            ORDER BY array_position(%(ids)s, p.id)
         """,
-            (id,),
+            {"ids": ids},
         )
-        row = cur.fetchone()
-        if row is not None:
-            new_product = {
-                "id": row[0],
-                "name": row[1],
-                "description": row[2],
-                "price": row[3],
-                "quantity": row[4],
-                "created_at": row[5],
-                "category_id": row[6],
-            }
-            return new_product
-        else:
-            return None
+        products = []
+        for row in cur.fetchall():
+            products.append(_product_row(row, include_names))
+        found = set(product["id"] for product in products)
+        return {"data": products, "missing": [id for id in ids if id not in found]}
     except Exception as e:
         raise e
     finally:
         cur.close()
 
 
+@write_query
 def upload_product(name: str, description: str, price: int, quantity: int, category_id: int):
     """
     Upload a new product to the database.
@@ -261,6 +502,7 @@ def upload_product(name: str, description: str, price: int, quantity: int, categ
     Returns:
     - int: The ID of the newly uploaded product.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute(
@@ -271,20 +513,216 @@ def upload_product(name: str, description: str, price: int, quantity: int, categ
             (name, description, price, quantity, "now()", category_id),
         )
         conn.commit()
-        return cur.fetchone()[0]
+        product_id = cur.fetchone()[0]
+        invalidate_product_cache(product_id)
+        return product_id
+
+    except Exception as e:
+        conn.rollback()
+        raise e
+
+    finally:
+        cur.close()
+
+
+@write_query
+def import_products(rows):
+    """
+    Load many products at once through a staging table.
+
+    The rows are streamed into a temporary table with COPY, IMPORT_BATCH_SIZE
+    at a time, then merged into products with one UPDATE (rows with an ID)
+    and one INSERT (rows without). Everything is committed together and the
+    product caches are invalidated once.
+
+    Parameters:
+    - rows (iterable): Validated rows as dictionaries with "line", "id" (None for a new product),
+      "name", "description", "price", "quantity" and "category_id". May be a generator.
+
+    Returns:
+    - dict: A dictionary with the following keys:
+        - "inserted" (int): Number of products created.
+        - "updated" (int): Number of products updated.
+        - "missing" (list): Lines whose ID matches no product; they are skipped.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            CREATE TEMP TABLE product_import (
+                line INTEGER NOT NULL,
+                id INTEGER,
+                name VARCHAR(35) NOT NULL,
+                description VARCHAR(200) NOT NULL,
+                price INTEGER NOT NULL,
+                quantity INTEGER NOT NULL,
+                category_id INTEGER NOT NULL
+            ) ON COMMIT DROP
+        """
+        )
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def copy_batch():
+            buffer.seek(0)
+            cur.copy_expert(
+                "COPY product_import (line, id, name, description, price, quantity, category_id) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+            buffer.seek(0)
+            buffer.truncate()
+
+        pending = 0
+        for row in rows:
+            # An empty unquoted CSV field is loaded as NULL
+            writer.writerow([
+                row["line"], row["id"] if row["id"] is not None else "", row["name"],
+                row["description"], row["price"], row["quantity"], row["category_id"],
+            ])
+            pending += 1
+            if pending == IMPORT_BATCH_SIZE:
+                copy_batch()
+                pending = 0
+        if pending:
+            copy_batch()
+
+        cur.execute(
+            """
+            SELECT s.line FROM product_import s
+            WHERE s.id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM products p WHERE p.id = s.id)
+            ORDER BY s.line
+        """
+        )
+        missing = [row[0] for row in cur.fetchall()]
+        cur.execute(
+            """
+            UPDATE products p
+            SET name = s.name, description = s.description, price = s.price,
+                quantity = s.quantity, category_id = s.category_id
+            FROM product_import s
+            WHERE p.id = s.id
+        """
+        )
+        updated = cur.rowcount
+        cur.execute(
+            """
+            INSERT INTO products (name, description, price, quantity, category_id)
+            SELECT name, description, price, quantity, category_id
+            FROM product_import
+            WHERE id IS NULL
+            ORDER BY line
+        """
+        )
+        inserted = cur.rowcount
+        conn.commit()
+        if inserted or updated:
+            invalidate_product_cache()
+        return {"inserted": inserted, "updated": updated, "missing": missing}
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        cur.close()
+
+
+# Columns patch_product() may change
+PATCHABLE_PRODUCT_COLUMNS = ["name", "description", "price", "quantity", "category_id"]
+
+
+@write_query
+def patch_product(product_id: int, changes: dict, expected_version: int = None):
+    """
+    Change only some columns of a product with one UPDATE ... RETURNING.
+
+    Parameters:
+    - product_id (int): The ID of the product to be updated.
+    - changes (dict): New values by column name, keys from PATCHABLE_PRODUCT_COLUMNS.
+    - expected_version (int, optional): Only update the product if it is still at this version.
 
+    Returns:
+    - dict or None: The updated product with the keys returned by get_product_by_id, or None
+      if no product has that ID or it is no longer at `expected_version`.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        columns = [column for column in PATCHABLE_PRODUCT_COLUMNS if column in changes]
+        assignments = ", ".join(f"{column} = %({column})s" for column in columns)
+        cur.execute(
+            f"""
+            UPDATE products p
+            SET {assignments}
+            WHERE p.id = %(product_id)s
+              AND (%(expected_version)s::integer IS NULL OR p.version = %(expected_version)s)
+            RETURNING {', '.join(PRODUCT_COLUMNS)}
+        """,
+            dict(changes, product_id=product_id, expected_version=expected_version),
+        )
+        row = cur.fetchone()
+        conn.commit()
+        if row is None:
+            return None
+        invalidate_product_cache(product_id)
+        return _product_row(row)
     except Exception as e:
         conn.rollback()
         raise e
+    finally:
+        cur.close()
+
+
+@write_query
+def update_products_price_and_stock(changes: list):
+    """
+    Set the price and/or quantity of many products with one statement.
+
+    Parameters:
+    - changes (list): Dictionaries with "id" and optionally "price" and "quantity";
+      a missing or None value leaves that column unchanged.
 
+    Returns:
+    - list: The IDs of the products that were updated. IDs matching no product are left out.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        updated = execute_values(
+            cur,
+            """
+            UPDATE products p
+            SET price = coalesce(v.price, p.price), quantity = coalesce(v.quantity, p.quantity)
+            FROM (VALUES %s) AS v(id, price, quantity)
+            WHERE p.id = v.id
+            RETURNING p.id
+        """,
+            [(change["id"], change.get("price"), change.get("quantity")) for change in changes],
+            template="(%s::integer, %s::integer, %s::integer)",
+            page_size=len(changes),
+            fetch=True,
+        )
+        conn.commit()
+        updated = [row[0] for row in updated]
+        if updated:
+            invalidate_product_cache(*updated)
+        return updated
+    except Exception as e:
+        conn.rollback()
+        raise e
     finally:
         cur.close()
 
 
-def update_product(product_id: int, name: str, description: str, price: int, quantity: int, category_id: int):
+@write_query
+def update_product(
+    product_id: int, name: str, description: str, price: int, quantity: int, category_id: int,
+    expected_version: int = None,
+):
     """
     Update an existing product in the database.
 
+    The creation time is kept; version and updated_at are bumped by the database.
+
     Parameters:
     - product_id (int): The ID of the product to be updated.
     - name (str): The updated name of the product.
@@ -292,30 +730,39 @@ def update_product(product_id: int, name: str, description: str, price: int, qua
     - price (float): The updated price of the product.
     - quantity (int): The updated quantity of the product.
     - category_id (int): The updated ID of the category to which the product belongs.
+    - expected_version (int, optional): Only update the product if it is still at this version.
 
     Returns:
-    - None
+    - dict or None: The new "version" and "updated_at" of the product, or None if no product
+      has that ID or it is no longer at `expected_version`.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute(
             """
             UPDATE products 
-            SET name=%s, description=%s, price=%s, quantity=%s, created_at=%s, category_id=%s
-            WHERE id=%s
+            SET name=%s, description=%s, price=%s, quantity=%s, category_id=%s
+            WHERE id=%s AND (%s::integer IS NULL OR version = %s)
+            RETURNING version, updated_at
         """,
             (
                 name,
                 description,
                 price,
                 quantity,
-                datetime.now(),
                 category_id,
                 product_id,
+                expected_version,
+                expected_version,
             ),
         )
+        row = cur.fetchone()
         conn.commit()
-        return "File updated successfully"
+        if row is None:
+            return None
+        invalidate_product_cache(product_id)
+        return {"version": row[0], "updated_at": row[1]}
     except Exception as e:
         conn.rollback()
         raise e
@@ -324,30 +771,51 @@ def update_product(product_id: int, name: str, description: str, price: int, qua
         cur.close()
 
 
-def update_product_quantity(product_id: int, quantity: int):
+@write_query
+def reserve_products_stock(quantities: dict):
     """
-    Update the quantity of an existing product in the database.
+    Atomically take several products out of stock with one statement.
+
+    Rows are locked in ID order first, so concurrent checkouts sharing products
+    cannot deadlock, and each product is only decremented if enough is left.
+    The caller commits (or rolls back) the surrounding transaction, and must
+    roll back when some products could not be reserved.
 
     Parameters:
-    - product_id (int): The ID of the product whose quantity is to be updated.
-    - quantity (int): The updated quantity of the product.
+    - quantities (dict): Maps product IDs to the quantity to take out of stock.
 
     Returns:
-    - None
+    - dict: Maps the IDs of the reserved products to a dictionary with their remaining
+      "quantity" and current "price". Products missing from the result do not exist
+      or do not have enough stock.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
-        cur.execute(
+        rows = execute_values(
+            cur,
             """
-            UPDATE products 
-            SET quantity=%s
-            WHERE id=%s
+            WITH v (id, quantity) AS (VALUES %s),
+            locked AS (
+                SELECT p.id FROM products p
+                JOIN v ON v.id = p.id
+                ORDER BY p.id
+                FOR UPDATE OF p
+            )
+            UPDATE products p
+            SET quantity = p.quantity - v.quantity
+            FROM v, locked
+            WHERE p.id = v.id AND locked.id = v.id AND p.quantity >= v.quantity
+            RETURNING p.id, p.quantity, p.price
         """,
-            (
-                quantity,
-                product_id,
-            ),
+            sorted(quantities.items()),
+            # Keep everything in a single statement
+            page_size=max(len(quantities), 1),
+            fetch=True,
         )
+        # The caller must call invalidate_product_cache() after committing
+        _clear_product_caches(tuple(quantities))
+        return {row[0]: {"quantity": row[1], "price": row[2]} for row in rows}
 
     except Exception as e:
         raise e
@@ -356,6 +824,7 @@ def update_product_quantity(product_id: int, quantity: int):
         cur.close()
 
 
+@write_query
 def delete_product(product_id: int):
     """
     Delete a product from the database based on its ID.
@@ -366,10 +835,12 @@ def delete_product(product_id: int):
     Returns:
     - None
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute("DELETE FROM products WHERE id = %s", (product_id,))
         conn.commit()
+        invalidate_product_cache(product_id)
     except Exception as e:
         conn.rollback()
         raise e
@@ -380,6 +851,7 @@ def delete_product(product_id: int):
 # PRODUCT IMAGES MODELS
 
 
+@read_query
 def get_all_product_images(product_id: int):
     """
     Retrieve a list of images associated with a specific product.
@@ -394,6 +866,7 @@ def get_all_product_images(product_id: int):
         - "image" (str): Image URL or file path.
     If no images are found for the specified product, returns None.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute(
@@ -416,6 +889,7 @@ def get_all_product_images(product_id: int):
         cur.close()
 
 
+@read_query
 def get_image_by_product_id_and_image_id(image_id: int,product_id: int):
     """
     Retrieve a product image based on its ID.
@@ -430,6 +904,7 @@ def get_image_by_product_id_and_image_id(image_id: int,product_id: int):
         - "image" (str): Image URL or file path.
         - "product_id" (int): ID of the product to which the image belongs.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute("SELECT * FROM product_images where id = %s AND product_id = %s", (image_id,product_id))
@@ -445,6 +920,7 @@ def get_image_by_product_id_and_image_id(image_id: int,product_id: int):
         cur.close()
 
 
+@write_query
 def upload_product_images(image_location: str, product_id: int):
     """
     Upload product images to the database for a specific product.
@@ -456,6 +932,7 @@ def upload_product_images(image_location: str, product_id: int):
     Returns:
     - None
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         for image in image_location:
@@ -464,6 +941,7 @@ def upload_product_images(image_location: str, product_id: int):
                 (image, product_id),
             )
         conn.commit()
+        invalidate_product_cache(product_id)
     except Exception as e:
         conn.rollback()
         raise e
@@ -471,6 +949,7 @@ def upload_product_images(image_location: str, product_id: int):
         cur.close()
 
 
+@write_query
 def delete_image_by_id(image_id: int, product_id: int):
     """
     Delete an image by its ID and associated product ID.
@@ -479,10 +958,12 @@ def delete_image_by_id(image_id: int, product_id: int):
         product_id (int): The ID of the product the image belongs to.
         image_id (int): The ID of the image to delete.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute("DELETE from product_images where id = %s AND product_id = %s", (image_id,product_id))
         conn.commit()
+        invalidate_product_cache(product_id)
     except Exception as e:
         conn.rollback()
         raise e
@@ -490,6 +971,7 @@ def delete_image_by_id(image_id: int, product_id: int):
         cur.close()
 
 
+@write_query
 def delete_images_by_product_id(product_id: int):
     """
     Delete all product images associated with a specific product.
@@ -500,10 +982,12 @@ def delete_images_by_product_id(product_id: int):
     Returns:
     - None
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute("DELETE from product_images where product_id = %s", (product_id,))
         conn.commit()
+        invalidate_product_cache(product_id)
     except Exception as e:
         conn.rollback()
         raise e
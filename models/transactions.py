@@ -1,7 +1,14 @@
-from db import conn
+from db import get_conn, read_query, write_query
 from datetime import datetime
+from pagination import decode_cursor, keyset, keyset_page
+from psycopg2.extras import execute_values
+import os
 
-def get_all_transactions(limit: int, page: int, max_date: int, min_date: int):
+# Rows fetched from the server-side cursor per round trip by stream_transactions
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+@read_query
+def get_all_transactions(limit: int, page: int, max_date: int, min_date: int, cursor: str = None):
     """
     Retrieve a list of transactions based on provided filters.
 
@@ -10,9 +17,12 @@ def get_all_transactions(limit: int, page: int, max_date: int, min_date: int):
         page (int): The page number for pagination.
         max_date (int): The maximum date for filtering transactions.
         min_date (int): The minimum date for filtering transactions.
+        cursor (str, optional): Keyset pagination cursor. When not None, `page` is ignored and
+            transactions are fetched after the ID encoded in the cursor ('' starts at the first one).
 
     Returns:
         list: A list of dictionaries containing transaction information.
+        In cursor mode a dictionary {"data": list, "next_cursor": str or None} is returned instead.
         Each dictionary contains the following keys:
         - "id" (int): Transaction ID.
         - "user_id" (int): ID of the user associated with the transaction.
@@ -21,6 +31,7 @@ def get_all_transactions(limit: int, page: int, max_date: int, min_date: int):
         - "phone_number" (str): Phone number associated with the transaction.
         - "created_at" (str): Timestamp indicating when the transaction was created.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         page = int(page)
@@ -49,9 +60,20 @@ def get_all_transactions(limit: int, page: int, max_date: int, min_date: int):
         else:
             where = ''
 
+        # Keyset pagination: seek past the last transaction ID of the previous page instead of using OFFSET
+        order = ""
+        if cursor is not None:
+            condition, order, after = keyset(["id"], "asc", decode_cursor(cursor, "id", "asc"))
+            if condition:
+                where = f"{where} AND {condition}" if where else f"WHERE {condition}"
+                values.update(after)
+            values["limit"] = limit + 1
+            values["offset"] = 0
+
         # Construct SQL query for retrieving transactions
         query = (f"""
         SELECT * FROM transactions p {where}
+        {order}
         limit %(limit)s offset %(offset)s
         """)
         
@@ -62,11 +84,11 @@ def get_all_transactions(limit: int, page: int, max_date: int, min_date: int):
         data = cur.fetchall()
         
         # If no transactions are fetched and the page exceeds the total number of rows, return an empty data list 
-        if not data and page >= cur.rowcount:
+        if cursor is None and not data and page >= cur.rowcount:
             return {"data": []}
         
         # Prepare fetched transactions for response
-        if data:
+        if data or cursor is not None:
             for item in data:
                 new_data = {
                     "id": item[0],
@@ -77,6 +99,8 @@ def get_all_transactions(limit: int, page: int, max_date: int, min_date: int):
                     "created_at": item[5],
                 }
                 list_data.append(new_data)
+            if cursor is not None:
+                return keyset_page(list_data, limit, "id", "asc", ["id"])
             return list_data
         else:
             return None
@@ -87,6 +111,7 @@ def get_all_transactions(limit: int, page: int, max_date: int, min_date: int):
         cur.close()
 
 
+@read_query
 def get_transactions_by_id(id):
     """
     Retrieve a transaction by its ID.
@@ -105,6 +130,7 @@ def get_transactions_by_id(id):
         - "phone_number" (str): Phone number associated with the transaction.
         - "created_at" (str): Timestamp indicating when the transaction was created.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute("SELECT * FROM transactions WHERE id = %s", (id,))
@@ -131,7 +157,8 @@ def get_transactions_by_id(id):
         cur.close()
 
 
-def get_transactions_by_user_id(user_id: int, limit: int, page: int, max_date: int, min_date: int):
+@read_query
+def get_transactions_by_user_id(user_id: int, limit: int, page: int, max_date: int, min_date: int, cursor: str = None):
     """
     Retrieve a list of transactions for a specific user based on provided filters.
 
@@ -141,9 +168,12 @@ def get_transactions_by_user_id(user_id: int, limit: int, page: int, max_date: i
         page (int): The page number for pagination.
         max_date (int): The maximum date for filtering transactions.
         min_date (int): The minimum date for filtering transactions.
+        cursor (str, optional): Keyset pagination cursor. When not None, `page` is ignored and
+            transactions are fetched after the ID encoded in the cursor ('' starts at the first one).
 
     Returns:
         list: A list of dictionaries containing transaction information.
+        In cursor mode a dictionary {"data": list, "next_cursor": str or None} is returned instead.
         Each dictionary contains the following keys:
         - "id" (int): Transaction ID.
         - "user_id" (int): ID of the user associated with the transaction.
@@ -152,6 +182,7 @@ def get_transactions_by_user_id(user_id: int, limit: int, page: int, max_date: i
         - "phone_number" (str): Phone number associated with the transaction.
         - "created_at" (str): Timestamp indicating when the transaction was created.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         page = int(page)
@@ -185,9 +216,20 @@ def get_transactions_by_user_id(user_id: int, limit: int, page: int, max_date: i
         else:
             where = ""
 
+        # Keyset pagination: seek past the last transaction ID of the previous page instead of using OFFSET
+        order = ""
+        if cursor is not None:
+            condition, order, after = keyset(["id"], "asc", decode_cursor(cursor, "id", "asc"))
+            if condition:
+                where = f"{where} AND {condition}" if where else f"WHERE {condition}"
+                values.update(after)
+            values["limit"] = limit + 1
+            values["offset"] = 0
+
         # Construct SQL query for retrieving transactions
         query = (f"""
         SELECT * FROM transactions p {where}
+        {order}
         limit %(limit)s offset %(offset)s
         """)
         
@@ -198,11 +240,11 @@ def get_transactions_by_user_id(user_id: int, limit: int, page: int, max_date: i
         data = cur.fetchall()
         
         # If no transactions are fetched and the page exceeds the total number of rows, return an empty data list 
-        if not data and page >= cur.rowcount:
+        if cursor is None and not data and page >= cur.rowcount:
             return {"data": []}
         
         # Prepare fetched transactions for response
-        if data:
+        if data or cursor is not None:
             for item in data:
                 new_data = {
                     "id": item[0],
@@ -213,6 +255,8 @@ def get_transactions_by_user_id(user_id: int, limit: int, page: int, max_date: i
                     "created_at": item[5],
                 }
                 list_data.append(new_data)
+            if cursor is not None:
+                return keyset_page(list_data, limit, "id", "asc", ["id"])
             return list_data
         else:
             return None
@@ -224,6 +268,7 @@ def get_transactions_by_user_id(user_id: int, limit: int, page: int, max_date: i
 
 
 
+@write_query
 def add_transaction(user_id: int, address: str, fullname: str, phone_number: int):
     """
     Add a new transaction to the database.
@@ -237,6 +282,7 @@ def add_transaction(user_id: int, address: str, fullname: str, phone_number: int
     Returns:
         int: The ID of the newly added transaction.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute(
@@ -250,6 +296,7 @@ def add_transaction(user_id: int, address: str, fullname: str, phone_number: int
         cur.close()
 
 
+@write_query
 def delete_transaction_by_user_id(user_id: int):
     """
     Delete transactions associated with a specific user from the database.
@@ -260,6 +307,7 @@ def delete_transaction_by_user_id(user_id: int):
     Returns:
         None
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute("DELETE from transactions where user_id = %s", (user_id,))
@@ -272,6 +320,7 @@ def delete_transaction_by_user_id(user_id: int):
 
 
 
+@write_query
 def delete_transaction_by_id(id: int):
     """
     Delete a transaction from the database based on its ID.
@@ -282,6 +331,7 @@ def delete_transaction_by_id(id: int):
     Returns:
         None
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute("DELETE from transactions where id = %s", (id,))
@@ -296,6 +346,7 @@ def delete_transaction_by_id(id: int):
 # TRANSACTION DETAILS
 
 
+@read_query
 def get_transaction_details_by_transaction_id(transaction_id: int):
     """
     Retrieve transaction details associated with a specific transaction ID.
@@ -308,6 +359,7 @@ def get_transaction_details_by_transaction_id(transaction_id: int):
         including detail ID, transaction ID, product ID, product price, quantity, sub total, and creation timestamp.
         Returns None if no details are found for the specified transaction ID.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute(
@@ -338,6 +390,7 @@ def get_transaction_details_by_transaction_id(transaction_id: int):
         cur.close()
 
 
+@read_query
 def get_transaction_details_by_user_id_and_product_id(user_id: int, product_id: int):
     """
     Retrieve transaction details associated with a specific user ID and product ID.
@@ -351,6 +404,7 @@ def get_transaction_details_by_user_id_and_product_id(user_id: int, product_id:
         including detail ID, transaction ID, product ID, quantity, price, and creation timestamp.
         Returns None if no details are found for the specified user ID and product ID.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute(
@@ -377,28 +431,152 @@ def get_transaction_details_by_user_id_and_product_id(user_id: int, product_id:
         cur.close()
 
 
-def add_transaction_details(transaction_id: int, product_id: int, product_price: int, quantity: int, sub_total: int):
+@write_query
+def add_transaction_details_bulk(transaction_id: int, details: list):
     """
-    Add transaction details to the database.
+    Add the details of a transaction with a single multi-row insert.
+
+    The caller commits the surrounding transaction.
 
     Parameters:
         transaction_id (int): The ID of the transaction associated with the details.
-        product_id (int): The ID of the product.
-        product_price (float): The price of the product.
-        quantity (int): The quantity of the product.
-        sub_total (float): The subtotal of the transaction detail.
+        details (list): A list of dictionaries with the keys "product_id", "product_price",
+            "quantity" and "sub_total".
 
     Returns:
         None
     """
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        execute_values(
+            cur,
+            "INSERT INTO transaction_details (transaction_id,product_id,product_price,quantity,sub_total) VALUES %s",
+            [
+                (transaction_id, item["product_id"], item["product_price"], item["quantity"], item["sub_total"])
+                for item in details
+            ],
+        )
+    except Exception as e:
+        raise e
+    finally:
+        cur.close()
+
+
+@write_query
+def checkout_transaction(user_id: int, address: str, fullname: str, phone_number: str, product_ids: list = None, quantities: list = None, cart_ids: list = None):
+    """
+    Run a whole checkout through the checkout_transaction database function.
+
+    Either `cart_ids` or `product_ids` with matching `quantities` must be given.
+    The caller commits on success and rolls back otherwise.
+
+    Parameters:
+        user_id (int): The ID of the user checking out.
+        address (str): The address associated with the transaction.
+        fullname (str): The full name associated with the transaction.
+        phone_number (str): The phone number associated with the transaction.
+        product_ids (list, optional): The IDs of the products bought.
+        quantities (list, optional): The quantity bought of each product.
+        cart_ids (list, optional): The IDs of the user's carts to check out instead.
+
+    Returns:
+        dict: A dictionary with the following keys:
+        - "transaction_id" (int or None): ID of the new transaction, None if nothing was written.
+        - "product_ids" (list): IDs of the products whose stock changed.
+        - "errors" (list): One dictionary per cart or product that could not be checked out.
+
+    Raises:
+        psycopg2.errors.UndefinedFunction: If the migration creating the function has not been applied.
+    """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute(
-            "INSERT INTO transaction_details (transaction_id,product_id,product_price,quantity,sub_total) VALUES (%s,%s,%s,%s,%s)",
-            (transaction_id, product_id, product_price, quantity, sub_total),
+            "SELECT checkout_transaction(%s, %s, %s, %s, %s::integer[], %s::integer[], %s::integer[])",
+            (user_id, address, fullname, phone_number, product_ids or [], quantities or [], cart_ids),
         )
+        return cur.fetchone()[0]
     except Exception as e:
         raise e
     finally:
         cur.close()
 
+
+def stream_transactions(max_date: str = None, min_date: str = None, batch_size: int = EXPORT_BATCH_SIZE):
+    """
+    Iterate over every transaction together with its details, in constant memory.
+
+    Rows are read through a named (server-side) cursor, `batch_size` at a time,
+    so only one batch is held in memory whatever the size of the table. The
+    generator keeps the request's connection in a transaction until it is
+    exhausted or closed; it is not retried on connection loss.
+
+    Parameters:
+        max_date (str, optional): The maximum date for filtering transactions.
+        min_date (str, optional): The minimum date for filtering transactions.
+        batch_size (int, optional): Rows fetched per round trip.
+
+    Yields:
+        list: A batch of dictionaries with the keys of get_all_transactions plus
+        "details" (list), the transaction's details as dictionaries with "id",
+        "product_id", "product_price", "quantity" and "sub_total".
+    """
+    where = []
+    values = {}
+    if max_date and min_date:
+        where.append("t.created_at BETWEEN %(min_date)s AND %(max_date)s")
+        values["min_date"] = min_date
+        values["max_date"] = max_date
+    elif min_date:
+        where.append("t.created_at >= %(min_date)s")
+        values["min_date"] = min_date
+    elif max_date:
+        where.append("t.created_at <= %(max_date)s")
+        values["max_date"] = max_date
+    where = "WHERE " + " AND ".join(where) if where else ""
+
+    conn = get_conn()
+    cur = conn.cursor(name="stream_transactions")
+    try:
+        cur.execute(
+            f"""
+            SELECT t.id, t.user_id, t.address, t.fullname, t.phone_number, t.created_at,
+                   (
+                       SELECT coalesce(json_agg(json_build_object(
+                           'id', d.id,
+                           'product_id', d.product_id,
+                           'product_price', d.product_price,
+                           'quantity', d.quantity,
+                           'sub_total', d.sub_total
+                       ) ORDER BY d.id), '[]'::json)
+                       FROM transaction_details d
+                       WHERE d.transaction_id = t.id
+                   ) AS details
+            FROM transactions t
+            {where}
+            ORDER BY t.id
+        """,
+            values,
+        )
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [
+                {
+                    "id": row[0],
+                    "user_id": row[1],
+                    "address": row[2],
+                    "fullname": row[3],
+                    "phone_number": row[4],
+                    "created_at": row[5],
+                    "details": row[6],
+                }
+                for row in rows
+            ]
+    finally:
+        if not conn.closed:
+            cur.close()
+            conn.rollback()
+
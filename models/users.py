@@ -1,6 +1,7 @@
-from db import conn
+from db import get_conn, read_query, write_query
 
 
+@read_query
 def get_user_id(id: int):
     """
     Retrieve user information by user ID.
@@ -11,6 +12,7 @@ def get_user_id(id: int):
     Returns:
     - tuple or None: A tuple containing user information if the user is found, or None if the user ID is not found.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute('SELECT * FROM users WHERE id = %s', (id,))
@@ -20,6 +22,7 @@ def get_user_id(id: int):
     finally:
         cur.close()
 
+@read_query
 def find_email_password(email: str, password: str):
     """
     Find a user by email and password.
@@ -37,6 +40,7 @@ def find_email_password(email: str, password: str):
     - If the password matches, it returns a dictionary containing user ID, username (combination of first name and last name), and role.
     - If no user is found with the provided email or if the password does not match, it returns None.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute('SELECT id, first_name, last_name, email, password, role FROM users WHERE email = %s', (email,))
@@ -58,6 +62,7 @@ def find_email_password(email: str, password: str):
     
 
 
+@write_query
 def add_user_data(first_name: str, last_name, email, password):
     """
     Add user data to the database.
@@ -76,6 +81,7 @@ def add_user_data(first_name: str, last_name, email, password):
     - It hashes the provided password using bcrypt before storing it in the database.
     - The role of the user is set to "user" by default.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         
@@ -89,7 +95,9 @@ def add_user_data(first_name: str, last_name, email, password):
         cur.close()
 
 
+@write_query
 def add_admin_data(first_name,last_name,email,password):
+    conn = get_conn()
     cur = conn.cursor()
     try:
         
@@ -101,6 +109,7 @@ def add_admin_data(first_name,last_name,email,password):
     finally:
         cur.close()
 
+@read_query
 def find_email(request):
     """
     Check if the email exists in the database.
@@ -113,6 +122,8 @@ def find_email(request):
     """
     email = request.form.get('email')
     
+    conn = get_conn()
+    
     cur = conn.cursor()
     try:
         cur.execute('SELECT email,password FROM users where email = %s', (email,))
@@ -123,6 +134,7 @@ def find_email(request):
     finally:
         cur.close()
 
+@read_query
 def get_user_data(id: int):
     """
     Retrieve user data from the database by user ID.
@@ -136,6 +148,7 @@ def get_user_data(id: int):
     Note:
     - This function retrieves user data from the database based on the provided user ID.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute('SELECT first_name, last_name, email, password, role FROM users WHERE id = %s', (id,))
@@ -154,6 +167,7 @@ def get_user_data(id: int):
         cur.close()
 
 
+@write_query
 def update_data_user(id, first_name, last_name, email, password):
     """
     Update user data in the database.
@@ -171,6 +185,7 @@ def update_data_user(id, first_name, last_name, email, password):
     Note:
     - This function updates the user data in the database based on the provided user ID.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         
@@ -197,6 +212,7 @@ def update_data_user(id, first_name, last_name, email, password):
     finally:
         cur.close()
 
+@write_query
 def delete_user(id: int):
     """
     Delete a user from the database.
@@ -210,6 +226,7 @@ def delete_user(id: int):
     Note:
     - This function deletes a user from the database based on the provided user ID.
     """
+    conn = get_conn()
     cur = conn.cursor()
     try:
         cur.execute('DELETE FROM users WHERE id = %s', (id,))
@@ -0,0 +1,100 @@
+import base64, binascii, json
+import errors
+
+
+def encode_cursor(order_by: str, sort: str, key: list):
+    """
+    Build an opaque cursor pointing just after a row.
+
+    Parameters:
+        order_by (str): The column the listing is ordered by.
+        sort (str): The sorting order ('asc' or 'desc').
+        key (list): The values of the ordering columns of the last row returned.
+
+    Returns:
+        str: A URL-safe cursor to pass back as the `cursor` query parameter.
+    """
+    payload = json.dumps({"o": order_by, "s": sort, "k": key}, default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, order_by: str, sort: str):
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Parameters:
+        cursor (str): The cursor sent by the client. An empty cursor starts from the first row.
+        order_by (str): The column the current request orders by.
+        sort (str): The sorting order of the current request.
+
+    Returns:
+        list or None: The key of the last row of the previous page, or None for the first page.
+
+    Raises:
+        errors.ValueError: If the cursor is malformed or was issued for a different ordering.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        key = payload["k"]
+        if not isinstance(key, list):
+            raise TypeError("cursor key must be a list")
+    except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError):
+        raise errors.ValueError({"cursor": ["Invalid cursor."]})
+    if payload.get("o") != order_by or payload.get("s") != sort:
+        raise errors.ValueError({"cursor": ["Cursor does not match the requested order_by and sort."]})
+    return key
+
+
+def keyset(columns: list, sort: str, key: list = None):
+    """
+    Build the SQL pieces of a keyset (seek) page.
+
+    Parameters:
+        columns (list): The ordering columns, ending with a unique column such as the ID.
+        sort (str): The sorting order ('asc' or 'desc'), applied to every column.
+        key (list, optional): The decoded cursor key, or None for the first page.
+
+    Returns:
+        tuple: (condition, order, values) where condition is a WHERE condition
+        (None on the first page), order is the ORDER BY clause and values are
+        the query parameters used by the condition.
+    """
+    direction = "DESC" if sort == "desc" else "ASC"
+    order = "ORDER BY " + ", ".join(f"{column} {direction}" for column in columns)
+    if key is None:
+        return None, order, {}
+    if len(key) != len(columns):
+        raise errors.ValueError({"cursor": ["Invalid cursor."]})
+    operator = "<" if sort == "desc" else ">"
+    placeholders = ", ".join(f"%(after_{i})s" for i in range(len(columns)))
+    condition = f"({', '.join(columns)}) {operator} ({placeholders})"
+    values = {f"after_{i}": value for i, value in enumerate(key)}
+    return condition, order, values
+
+
+def keyset_page(items: list, limit: int, order_by: str, sort: str, key_fields: list):
+    """
+    Trim a keyset query result to one page and compute its next cursor.
+
+    The query is expected to fetch limit + 1 rows; the extra row only tells
+    whether another page exists.
+
+    Parameters:
+        items (list): The fetched rows as dictionaries.
+        limit (int): The page size requested by the client.
+        order_by (str): The column the listing is ordered by, stored in the cursor.
+        sort (str): The sorting order, stored in the cursor.
+        key_fields (list): The dictionary keys that make up the cursor key.
+
+    Returns:
+        dict: {"data": items of this page, "next_cursor": cursor or None on the last page}.
+    """
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor(order_by, sort, [last[field] for field in key_fields])
+    return {"data": items, "next_cursor": next_cursor}